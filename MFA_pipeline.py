@@ -1,23 +1,53 @@
 import os
 import sys
+import csv
+import json
 import shutil
+import hashlib
+import argparse
 import subprocess
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 from praatio import textgrid
+from textgrid_reader import read_textgrid
+import instrumentation
 
 # STEP 1: preprocess the ASR output (.csv to .txt)
+# values pandas reads as missing (they were dropped when the file was read with pd.read_csv)
+NA_VALUES = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+}
+
 def csv_to_txt(csv_path, txt_path):
-    df = pd.read_csv(csv_path, sep=";")
+    with instrumentation.stage("csv_to_txt", file=csv_path) as s:
+        # stream the rows and keep only the 'ORT' column
+        with open(csv_path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.reader(f, delimiter=";")
+            header = next(reader, [])
+            if "ORT" not in header:
+                raise ValueError(f"No 'ORT' column found in {csv_path}")
+            ort = header.index("ORT")
+
+            # get words in the 'ORT' column
+            words = [row[ort].strip() for row in reader if len(row) > ort and row[ort] not in NA_VALUES]
 
-    # get words in the 'ORT' column
-    words = df["ORT"].dropna().astype(str).tolist()
-    with open(txt_path, "w", encoding="utf-8") as f:
-        for word in words:
-            f.write(word.strip() + "\n")
+        # one buffered write
+        with open(txt_path, "w", encoding="utf-8") as f:
+            f.write("".join(word + "\n" for word in words))
+        s.items = len(words)
     
     print(f"Converted {len(words)} phrasal words.")
 
+# convert every .csv in a folder to a .txt next to it, in parallel processes if jobs > 1
+# (returns the (csv, txt) pairs that failed with their errors)
+def csv_to_txt_folder(folder, jobs=1):
+    csv_paths = sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(".csv"))
+    path_pairs = [(csv_path, f"{os.path.splitext(csv_path)[0]}.txt") for csv_path in csv_paths]
+    return instrumentation.run_batch(csv_to_txt, path_pairs, jobs, action="converting")
+
 # STEP 2: create folder & move .wav and .txt files
+# (main() no longer moves files, see stage_files; this is kept to move back files left in p{file_id} folders)
 def organize_files(base_dir, file_id, mode="to_subfolder"):
     folder_path = os.path.join(base_dir, f"p{file_id}")
     os.makedirs(folder_path, exist_ok=True)
@@ -41,49 +71,151 @@ def organize_files(base_dir, file_id, mode="to_subfolder"):
             print(f"Error during move: {e}")
 
 # STEP 3: run MFA (option: "--single_speaker", "--clean")
-def run_mfa(staging_dir, dict_path, model_path, output_dir):
+def run_mfa(staging_dir, dict_path, model_path, output_dir, num_jobs=None, temp_dir=None, clean=True):
     print("Running MFA alignment on all files...")
-    subprocess.run([
-        "mfa", "align", "--clean", "--single_speaker",
-        staging_dir, dict_path, model_path, output_dir, 
-    ])
-    print("MFA alignment complete.")
+    command = ["mfa", "align", "--single_speaker"]
+    if clean:
+        command.append("--clean")
+    if num_jobs is not None:
+        command += ["--num_jobs", str(num_jobs)]
+    if temp_dir is not None:
+        command += ["--temporary_directory", temp_dir]
+    with instrumentation.stage("mfa", file=staging_dir):
+        result = subprocess.run(command + [staging_dir, dict_path, model_path, output_dir])
+    if result.returncode != 0:
+        print(f"MFA alignment failed with exit code {result.returncode}.")
+    else:
+        print("MFA alignment complete.")
+    return result.returncode
+
+# link a file into a staging folder: hard link, else symlink (e.g. across devices), else copy
+def link_file(src, dst):
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        try:
+            os.symlink(os.path.abspath(src), dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+# STEP 2: build a staging corpus (corpus_dir/p{file_id}/{file_id}.wav and .txt) of links to the files in base_dir
+# (the originals are never moved, so nothing is left behind if a run crashes)
+def stage_files(base_dir, corpus_dir, file_ids):
+    with instrumentation.stage("stage_files", file=corpus_dir, items=len(file_ids)):
+        for file_id in file_ids:
+            speaker_dir = os.path.join(corpus_dir, f"p{file_id}")
+            os.makedirs(speaker_dir, exist_ok=True)
+            for typ in ["wav", "txt"]:
+                link_file(os.path.join(base_dir, f"{file_id}.{typ}"), os.path.join(speaker_dir, f"{file_id}.{typ}"))
+
+# STEP 3 (sharded): split the file pairs into several staging corpora and run MFA on them in parallel
+# prepare(file_ids) is called in the shard's thread before staging and returns the IDs that are ready
+# (e.g. waits for their .txt files); on_shard_done(file_ids) is called as soon as a shard's output is merged
+def run_mfa_sharded(base_dir, file_ids, dict_path, model_path, output_dir, shards=2, max_parallel=2, num_jobs=None, clean=True,
+                    prepare=None, on_shard_done=None):
+    shard_root = os.path.join(base_dir, "mfa_shards")
+    temp_root = os.path.join(base_dir, "mfa_tmp")
+    file_ids = sorted(file_ids)
+    shard_ids = [file_ids[i::shards] for i in range(shards) if file_ids[i::shards]]
+
+    def align_shard(k):
+        ids = prepare(shard_ids[k]) if prepare is not None else shard_ids[k]
+        shard_ids[k] = ids
+        if not ids:
+            return 0
+
+        # build the staging corpus with links to the .wav and .txt files of the shard's speakers
+        # (each shard gets its own temporary directory, so the MFA processes don't collide; it is removed
+        # once the shard is aligned, and one left behind by a failed run is removed before the next one)
+        shard_dir = os.path.join(shard_root, f"shard_{k}")
+        temp_dir = os.path.join(temp_root, f"shard_{k}")
+        for path in (shard_dir, temp_dir):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+        corpus_dir = os.path.join(shard_dir, "corpus")
+        stage_files(base_dir, corpus_dir, ids)
+
+        returncode = run_mfa(
+            corpus_dir, dict_path, model_path, os.path.join(shard_dir, "aligned"),
+            num_jobs=num_jobs, temp_dir=temp_dir, clean=clean,
+        )
+        if returncode != 0:
+            return returncode
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+        # merge the aligned output into output_dir/p{file_id}, the layout step 4 expects
+        with instrumentation.stage("merge_output", file=shard_dir, items=len(ids)):
+            for file_id in ids:
+                src = os.path.join(shard_dir, "aligned", f"p{file_id}")
+                dst = os.path.join(output_dir, f"p{file_id}")
+                if not os.path.exists(src):
+                    print(f"No MFA output for {file_id} in shard {k}")
+                    continue
+                if os.path.exists(dst):
+                    shutil.rmtree(dst)
+                os.makedirs(output_dir, exist_ok=True)
+                shutil.move(src, dst)
+            shutil.rmtree(shard_dir)
+        return 0
+
+    # run the shards (at most max_parallel MFA processes at once); a failed shard doesn't stop the others
+    failed = {}
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        futures = {executor.submit(align_shard, k): k for k in range(len(shard_ids))}
+        for future in as_completed(futures):
+            k = futures[future]
+            try:
+                returncode = future.result()
+            except Exception as e:
+                returncode = e
+            if returncode != 0:
+                print(f"MFA failed on shard {k} ({', '.join(shard_ids[k])}): {returncode}")
+                failed[k] = shard_ids[k]
+                continue
+
+            print(f"Shard {k} aligned: {', '.join(shard_ids[k])}")
+            if on_shard_done is not None and shard_ids[k]:
+                on_shard_done(shard_ids[k])
+
+    # the staging corpora and temporary directories of failed shards are kept for inspection
+    if not failed:
+        for path in (shard_root, temp_root):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+    return failed
 
 # STEP 4: merge intervals in the mfa .TextGrid file output
+# group the words into utterances: a new utterance starts where the pause between two words is longer than pause_threshold
+def segment_utterances(word_entries, pause_threshold=0.2):
+    words = [(start, end, label.strip()) for start, end, label in word_entries if label.strip() != ""]
+    if not words:
+        return []
+
+    starts = np.array([word[0] for word in words], dtype=np.float64)
+    ends = np.array([word[1] for word in words], dtype=np.float64)
+
+    # a word starts a new utterance if the pause before it is longer than the threshold
+    is_break = (starts[1:] - ends[:-1]) > pause_threshold
+    first = np.flatnonzero(np.concatenate(([True], is_break)))
+    last = np.concatenate((first[1:] - 1, [len(words) - 1]))
+
+    labels = [word[2] for word in words]
+    return [
+        (words[i][0], words[j][1], "".join(labels[i:j + 1]))
+        for i, j in zip(first.tolist(), last.tolist())
+    ]
+
 def from_pauses(textgrid_path, output_path, pause_threshold=0.2):
-    tg = textgrid.openTextgrid(textgrid_path, includeEmptyIntervals=True)
+    # only the 'words' tier is needed (the 'phones' tier is not parsed)
+    tg = read_textgrid(textgrid_path, ["words"], include_empty=True)
     if "words" not in tg.tierNames:
         raise ValueError("No 'words' tier found in TextGrid")
     word_tier = tg.getTier("words")
-    entries = word_tier.entries
-
-    sentence_intervals = []
-    sentence = []
-    sentence_start = None
-
-    for i, (start, end, label) in enumerate(entries):
-        label = label.strip()
-        if label != "":
-            if sentence_start is None:
-                sentence_start = start
-            sentence.append((start, end, label))
-            if i + 1 < len(entries):
-                next_label = entries[i + 1][2].strip()
-                if next_label == "":
-                    sentence_end = end
-                    sentence_intervals.append((sentence_start, sentence_end, sentence))
-                    sentence = []
-                    sentence_start = None
-        elif sentence:
-            sentence_end = entries[i - 1][1]
-            sentence_intervals.append((sentence_start, sentence_end, sentence))
-            sentence = []
-            sentence_start = None
-
-    new_entries = []
-    for start, end, word_list in sentence_intervals:
-        combined = "".join([w for _, _, w in word_list])
-        new_entries.append((start, end, combined))
+    with instrumentation.stage("segment_utterances", file=textgrid_path) as s:
+        new_entries = segment_utterances(word_tier.entries, pause_threshold)
+        s.items = len(new_entries)
 
     for tier in ["phones", "words"]:
         if tier in tg.tierNames:
@@ -93,16 +225,106 @@ def from_pauses(textgrid_path, output_path, pause_threshold=0.2):
     tg.addTier(textgrid.IntervalTier(name="utterances", entries=new_entries, minT=0, maxT=tg.maxTimestamp))
     tg.addTier(textgrid.IntervalTier(name="FPs", entries=[], minT=0, maxT=tg.maxTimestamp))
 
-    tg.save(output_path, format="short_textgrid", includeBlankSpaces=True)
-    print(f"Saved merged TextGrid to {output_path}")
+    # output_path=None keeps the result in memory only (e.g. to pass it on to extracting_features.extract_frames)
+    if output_path is not None:
+        with instrumentation.stage("save_preprocessed", file=output_path):
+            tg.save(output_path, format="short_textgrid", includeBlankSpaces=True)
+        print(f"Saved merged TextGrid to {output_path}")
+    return tg
+
+# run from_pauses on many (textgrid_path, output_path) pairs in one call, in parallel processes if jobs > 1
+# (returns the pairs that failed with their errors)
+def from_pauses_batch(path_pairs, pause_threshold=0.2, jobs=1):
+    arg_tuples = [(src, dst, pause_threshold) for src, dst in path_pairs]
+    failed = instrumentation.run_batch(from_pauses, arg_tuples, jobs, action="merging intervals of")
+    return [(args[:2], e) for args, e in failed]
+
+# Manifest of the previous runs: hashes of each pair's .wav and .csv and the TextGrid made from them
+MANIFEST_NAME = "mfa_manifest.json"
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_manifest(base_dir):
+    manifest_path = os.path.join(base_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable manifest {manifest_path}: {e}")
+        return {}
+
+def save_manifest(base_dir, manifest):
+    manifest_path = os.path.join(base_dir, MANIFEST_NAME)
+    with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+def input_hashes(base_dir, file_id):
+    return {typ: file_hash(os.path.join(base_dir, f"{file_id}.{typ}")) for typ in ["wav", "csv"]}
+
+def is_up_to_date(base_dir, file_id, manifest, hashes):
+    entry = manifest.get(file_id)
+    if entry is None or any(entry.get(typ) != hashes[typ] for typ in hashes):
+        return False
+    return os.path.exists(os.path.join(base_dir, entry["textgrid"]))
+
+def preprocessed_path(base_dir, file_id):
+    return os.path.join(base_dir, f"{file_id}_preprocessed.TextGrid")
+
+# a _preprocessed.TextGrid that differs from the one this pipeline wrote (or that the manifest has no record of)
+# has been annotated by hand and must not be overwritten by a new alignment
+def is_annotated(base_dir, file_id, manifest):
+    path = preprocessed_path(base_dir, file_id)
+    if not os.path.exists(path):
+        return False
+    return file_hash(path) != manifest.get(file_id, {}).get("textgrid_sha256")
 
 # MAIN PIPELINE
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python preprocessing_annotation_folder.py <base_dir>")
-        return
+    parser = argparse.ArgumentParser(description="Prepare ASR output and audio for annotation: csv to txt, MFA alignment, utterance tiers")
+    parser.add_argument("base_dir")
+    parser.add_argument("--shards", type=int, default=1, help="split the corpus into this many MFA runs (default: 1)")
+    parser.add_argument("--max-parallel", type=int, default=2, help="maximum number of MFA runs at once with --shards (default: 2)")
+    parser.add_argument("--num-jobs", type=int, help="value for MFA's --num_jobs")
+    parser.add_argument("--force", action="store_true",
+                        help="align all file pairs, not only new or changed ones, and overwrite annotated TextGrids (a .bak copy is kept)")
+    parser.add_argument("--workers", type=int, default=4, help="threads for csv conversion and merging (default: 4)")
+    parser.add_argument("--presegment", action="store_true", help="propose Q/R turns and FPs from the audio in the new TextGrids (step 5)")
+    parser.add_argument("--trace", help="record the time and memory of each stage, save them to this JSON file and print a summary")
+    args = parser.parse_args()
+
+    if args.trace:
+        instrumentation.enable()
+        try:
+            failed = run_pipeline(args)
+        finally:
+            instrumentation.save_trace(args.trace)
+            instrumentation.print_summary()
+            print(f"Trace saved to: {args.trace}")
+    else:
+        failed = run_pipeline(args)
+    sys.exit(1 if failed else 0)
+
+# the steps of main() for the parsed command line arguments
+# (returns the IDs of the file pairs that failed in any step or were skipped because they were annotated)
+def run_pipeline(args):
+    base_dir = args.base_dir
+
+    # move back files left in p{file_id} folders by older versions of this pipeline
+    for name in os.listdir(base_dir):
+        file_id = name[1:]
+        if name.startswith("p") and os.path.isfile(os.path.join(base_dir, name, f"{file_id}.wav")) \
+                and not os.path.exists(os.path.join(base_dir, f"{file_id}.wav")):
+            print(f"Moving back files of {file_id} left in {name}")
+            organize_files(base_dir, file_id, mode="to_base")
 
-    base_dir = sys.argv[1]
     files = os.listdir(base_dir)
 
     # Step 0: find all file pairs of .csv and .wav
@@ -110,50 +332,126 @@ def main():
     matched_ids = [fid for fid in base_ids if f"{fid}.wav" in files]
     print(f"Found {len(matched_ids)} valid file pairs.")
 
-    # Step 1: csv to txt
+    # only new or changed pairs, and pairs whose _preprocessed.TextGrid is missing, are aligned
+    manifest = load_manifest(base_dir)
+    with instrumentation.stage("hash_inputs", items=len(matched_ids)):
+        hashes = {fid: input_hashes(base_dir, fid) for fid in matched_ids}
+
+    # pairs preprocessed before there was a manifest (e.g. by an older version of this pipeline) are recorded as
+    # they are and count as up to date, since their TextGrids may already be annotated (--force still re-aligns them)
+    if not args.force:
+        adopted = sorted(fid for fid in matched_ids if fid not in manifest and os.path.exists(preprocessed_path(base_dir, fid)))
+        for fid in adopted:
+            manifest[fid] = {
+                **hashes[fid], "textgrid": os.path.basename(preprocessed_path(base_dir, fid)),
+                "textgrid_sha256": file_hash(preprocessed_path(base_dir, fid)),
+            }
+        if adopted:
+            print(f"Recorded {len(adopted)} file pair(s) preprocessed before the manifest existed: {', '.join(adopted)}")
+            save_manifest(base_dir, manifest)
+
+    matched_ids = sorted(fid for fid in matched_ids if args.force or not is_up_to_date(base_dir, fid, manifest, hashes[fid]))
+    print(f"{len(matched_ids)} new or changed file pairs to align, {len(hashes) - len(matched_ids)} up to date.")
+
+    # annotated TextGrids are only replaced with --force (after a backup), otherwise their pairs are skipped
+    annotated = [fid for fid in matched_ids if is_annotated(base_dir, fid, manifest)]
+    skipped = []
+    if annotated and not args.force:
+        print(f"Not aligning {len(annotated)} file pair(s) whose _preprocessed.TextGrid was annotated "
+              f"(use --force to overwrite it, a .bak copy is kept): {', '.join(annotated)}")
+        skipped = annotated
+        matched_ids = [fid for fid in matched_ids if fid not in skipped]
+    if not matched_ids:
+        return skipped
+
+    # the steps overlap: each shard is staged and aligned as soon as its .txt files are ready,
+    # and its TextGrids are merged as soon as the shard is done (use --shards to get results early)
+    aligned_dir = os.path.join(base_dir, "aligned")
+
+    # remove old alignments, so a failed run can't leave an outdated TextGrid for step 4
     for file_id in matched_ids:
+        if os.path.exists(os.path.join(aligned_dir, f"p{file_id}")):
+            shutil.rmtree(os.path.join(aligned_dir, f"p{file_id}"))
+
+    # Step 1: csv to txt
+    def convert(file_id):
         try:
             print(f"\n[Step 1] Converting {file_id}.csv → .txt")
             csv_path = os.path.join(base_dir, f"{file_id}.csv")
             txt_path = os.path.join(base_dir, f"{file_id}.txt")
             csv_to_txt(csv_path, txt_path)
+            return True
         except Exception as e:
             print(f"Error converting {file_id}: {e}")
-
-    # Step 2: organize files
-    for file_id in matched_ids:
-        try:
-            print(f"\n[Step 2] Organizing {file_id}")
-            organize_files(base_dir, file_id, mode="to_subfolder")
-        except Exception as e:
-            print(f"Error organizing {file_id}: {e}")
-
-    # Step 3: run MFA
-    try:
-        print(f"\n[Step 3] Running MFA on {base_dir}")
-        aligned_dir = os.path.join(base_dir, "aligned")
-        run_mfa(base_dir, "korean_mfa", "korean_mfa", aligned_dir)
-    except Exception as e:
-        print(f"MFA failed: {e}")
-        return
+            return False
 
     # Step 4: merge intervals in TextGrid created by MFA
-    for file_id in matched_ids:
+    def merge(file_id):
         try:
             print(f"\n[Step 4] Merging intervals for {file_id}")
             aligned_textgrid_path = os.path.join(aligned_dir, f"p{file_id}", f"{file_id}.TextGrid")
-            output_path = os.path.join(base_dir, f"{file_id}_preprocessed.TextGrid")
+            output_path = preprocessed_path(base_dir, file_id)
+            if file_id in annotated:
+                shutil.copy2(output_path, f"{output_path}.bak")
+                print(f"Annotated {os.path.basename(output_path)} backed up to {os.path.basename(output_path)}.bak")
             from_pauses(aligned_textgrid_path, output_path)
+            return {**hashes[file_id], "textgrid": os.path.basename(output_path), "textgrid_sha256": file_hash(output_path)}
         except Exception as e:
             print(f"Error merging intervals of {file_id}: {e}")
-    
-    # Step 5: move .wav files back to base
-    for file_id in matched_ids:
+            return None
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        conversions = {file_id: pool.submit(convert, file_id) for file_id in matched_ids}
+        merges = {}
+
+        # Step 2 & 3: stage links to the files and run MFA on the staging corpora
+        # (only pairs whose conversion succeeded are staged)
+        def prepare(file_ids):
+            return [file_id for file_id in file_ids if conversions[file_id].result()]
+
+        def on_shard_done(file_ids):
+            for file_id in file_ids:
+                merges[file_id] = pool.submit(merge, file_id)
+
         try:
-            print(f"\n[Step 5] Moving {file_id}.wav back to base")
-            organize_files(base_dir, file_id, mode="to_base")
+            print(f"\n[Step 2 & 3] Staging {len(matched_ids)} file pairs and running MFA")
+            run_mfa_sharded(
+                base_dir, matched_ids, "korean_mfa", "korean_mfa", aligned_dir,
+                shards=args.shards, max_parallel=args.max_parallel, num_jobs=args.num_jobs,
+                prepare=prepare, on_shard_done=on_shard_done,
+            )
         except Exception as e:
-            print(f"Error moving {file_id}.wav: {e}")
+            print(f"MFA failed: {e}")
+
+        merged_ids = []
+        for file_id, future in merges.items():
+            entry = future.result()
+            if entry is not None:
+                manifest[file_id] = entry
+                merged_ids.append(file_id)
+
+    # pairs that failed in step 1, 3 (their shard) or 4 have no new TextGrid, like the skipped annotated ones
+    failed = sorted(set(matched_ids) - set(merged_ids)) + skipped
+
+    # Step 5 (optional): pre-fill the empty turns and FPs tiers from the speech in the recordings
+    # (imported here, so the other steps don't have to load pandas)
+    if args.presegment and merged_ids:
+        from presegmentation import presegment_batch
+        print(f"\n[Step 5] Pre-segmenting {len(merged_ids)} TextGrids")
+        path_pairs = [
+            (os.path.join(base_dir, manifest[file_id]["textgrid"]), os.path.join(base_dir, f"{file_id}.wav"))
+            for file_id in sorted(merged_ids)
+        ]
+        presegment_failed = presegment_batch(path_pairs, jobs=args.workers)
+        for file_id in merged_ids:
+            manifest[file_id]["textgrid_sha256"] = file_hash(os.path.join(base_dir, manifest[file_id]["textgrid"]))
+        failed += [os.path.basename(wav_path)[:-len(".wav")] for (_, wav_path), _ in presegment_failed]
+
+    save_manifest(base_dir, manifest)
+
+    if failed:
+        print(f"{len(failed)} file pair(s) not preprocessed: {', '.join(failed)}")
+    return failed
 
 
 if __name__ == "__main__":
@@ -0,0 +1,280 @@
+import os
+import sys
+import glob
+import struct
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import instrumentation
+from textgrid_reader import read_textgrid
+from extracting_features import ColumnarTier, Table, OUTPUT_FORMATS, round_values, save_table
+
+# Acoustic measures per response from the participant's .wav: intensity (RMS in dB re full scale),
+# energy per second and F0 (autocorrelation), for the whole response and for the FPs within it.
+# The .wav is memory-mapped and only the samples of each interval are read.
+
+# STEP 0: memory-map the samples of a .wav file (PCM 8/16/32 bit or 32/64 bit float)
+WavFile = namedtuple("WavFile", ["samples", "sample_rate", "zero", "full_scale"])
+
+WAV_FORMAT_PCM = 1
+WAV_FORMAT_FLOAT = 3
+WAV_FORMAT_EXTENSIBLE = 0xFFFE
+
+def open_wav(wav_path):
+    with open(wav_path, "rb") as f:
+        riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave != b"WAVE":
+            raise ValueError(f"Not a RIFF/WAVE file: {wav_path}")
+
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"No data chunk found in {wav_path}")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"data":
+                data_offset = f.tell()
+                data_size = chunk_size
+                break
+            if chunk_id == b"fmt ":
+                fmt = f.read(chunk_size)
+                f.seek(chunk_size % 2, 1)  # chunks are padded to an even size
+            else:
+                f.seek(chunk_size + chunk_size % 2, 1)
+
+    if fmt is None:
+        raise ValueError(f"No fmt chunk found in {wav_path}")
+    audio_format, channels, sample_rate, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+    if audio_format == WAV_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        audio_format = struct.unpack("<H", fmt[24:26])[0]  # first two bytes of the subformat GUID
+
+    if audio_format == WAV_FORMAT_PCM and bits == 8:
+        dtype, zero, full_scale = np.uint8, 128.0, 128.0
+    elif audio_format == WAV_FORMAT_PCM and bits == 24 and block_align == 3 * channels:
+        # no 3 byte dtype: the bytes of each sample are kept as they are and put together by to_mono
+        dtype, zero, full_scale = np.uint8, 0.0, float(2 ** 23)
+    elif audio_format == WAV_FORMAT_PCM and bits in (16, 32):
+        dtype, zero, full_scale = np.dtype(f"<i{bits // 8}"), 0.0, float(2 ** (bits - 1))
+    elif audio_format == WAV_FORMAT_FLOAT and bits in (32, 64):
+        dtype, zero, full_scale = np.dtype(f"<f{bits // 8}"), 0.0, 1.0
+    else:
+        raise ValueError(f"Unsupported WAV format in {wav_path}: format {audio_format}, {bits} bit")
+
+    # the data chunk ends where its size says (chunks such as LIST can follow it), but not past the end of the file
+    # (recordings that were cut off); streaming writers leave the size at 0 or 0xFFFFFFFF, then the file size counts
+    available = os.path.getsize(wav_path) - data_offset
+    if data_size in (0, 0xFFFFFFFF):
+        data_size = available
+    num_frames = min(data_size, available) // block_align
+    shape = (num_frames, channels, 3) if bits == 24 else (num_frames, channels)
+    if num_frames <= 0:
+        samples = np.zeros((0,) + shape[1:], dtype=dtype)
+    else:
+        samples = np.memmap(wav_path, dtype=dtype, mode="r", offset=data_offset, shape=shape)
+    return WavFile(samples, sample_rate, zero, full_scale)
+
+
+# samples of [start, end] in seconds as mono float64 in [-1, 1] (the slice of the memmap is a view,
+# only the interval itself is converted)
+def interval_samples(wav, start, end):
+    first = min(max(int(round(start * wav.sample_rate)), 0), len(wav.samples))
+    last = min(max(int(round(end * wav.sample_rate)), first), len(wav.samples))
+    return to_mono(wav, wav.samples[first:last])
+
+
+# a slice of wav.samples as mono float64 in [-1, 1] (24 bit samples are put together from their 3 bytes)
+def to_mono(wav, view):
+    if view.ndim == 3:
+        b = view.astype(np.int32)
+        view = ((b[..., 0] | (b[..., 1] << 8) | (b[..., 2] << 16)) ^ 0x800000) - 0x800000
+    return (view.mean(axis=1, dtype=np.float64) - wav.zero) / wav.full_scale
+
+
+# STEP 1: acoustic measures
+def energy(x):
+    # sum of squares and number of samples, so measures can be pooled over several intervals
+    return float(np.dot(x, x)), len(x)
+
+def rms_db(sum_squares, num_samples):
+    if num_samples == 0 or sum_squares <= 0:
+        return np.nan
+    return 10 * np.log10(sum_squares / num_samples)
+
+def energy_per_second(sum_squares, num_samples, sample_rate):
+    return sum_squares / (num_samples / sample_rate) if num_samples > 0 else np.nan
+
+# F0 of each voiced frame: autocorrelation (FFT) of all frames at once, the first peak between the lags of fmax
+# and fmin that is almost as high as the highest one (multiples of the period are just as high after the
+# unbiasing); a frame is voiced if the highest peak is at least voicing_threshold of its energy
+def frame_f0s(x, sample_rate, fmin=75, fmax=500, frame_sec=0.04, hop_sec=0.01, voicing_threshold=0.3):
+    frame_len = int(frame_sec * sample_rate)
+    hop = max(int(hop_sec * sample_rate), 1)
+    min_lag = max(int(sample_rate / fmax), 1)
+    max_lag = min(int(sample_rate / fmin), frame_len - 1)
+    if len(x) < frame_len or min_lag >= max_lag:
+        return np.empty(0), 0
+
+    frames = sliding_window_view(x, frame_len)[::hop]
+    frames = frames - frames.mean(axis=1, keepdims=True)
+    n_fft = 1 << (2 * frame_len - 1).bit_length()
+    spectrum = np.fft.rfft(frames, n_fft, axis=1)
+    autocorr = np.fft.irfft(spectrum.real ** 2 + spectrum.imag ** 2, n_fft, axis=1)[:, :max_lag + 1]
+    # unbiased: longer lags overlap fewer samples
+    autocorr[:, 1:] *= frame_len / (frame_len - np.arange(1, max_lag + 1))
+
+    candidates = autocorr[:, min_lag:]
+    peak = candidates.max(axis=1)
+    is_local_max = np.zeros(candidates.shape, dtype=bool)
+    is_local_max[:, 1:-1] = (candidates[:, 1:-1] >= candidates[:, :-2]) & (candidates[:, 1:-1] > candidates[:, 2:])
+    is_first_peak = is_local_max & (candidates >= 0.9 * peak[:, None])
+    best = np.where(is_first_peak.any(axis=1), np.argmax(is_first_peak, axis=1), np.argmax(candidates, axis=1))
+
+    # parabolic interpolation around the peak for a lag between samples
+    rows = np.arange(len(frames))
+    inner = np.clip(best, 1, candidates.shape[1] - 2)
+    y0, y1, y2 = candidates[rows, inner - 1], candidates[rows, inner], candidates[rows, inner + 1]
+    curvature = y0 - 2 * y1 + y2
+    shift = np.divide(0.5 * (y0 - y2), curvature, out=np.zeros(len(frames)), where=curvature < 0)
+    lags = np.where(best == inner, best + np.clip(shift, -0.5, 0.5), best) + min_lag
+
+    voiced = (autocorr[:, 0] > 0) & (peak >= voicing_threshold * autocorr[:, 0])
+    return sample_rate / lags[voiced], len(frames)
+
+
+# STEP 2: one row per response (R turn) with the measures of the response and of its FPs
+ACOUSTIC_COLUMNS = (
+    "ParticipantID", "QuestionNum", "DurationSec", "RMSdB", "EnergyPerSec", "F0Hz", "VoicedRatio",
+    "FPNum", "FPRMSdB", "FPF0Hz",
+)
+
+def extract_acoustics(tg, wav, participant_id):
+    turns = ColumnarTier.from_entries(tg.getTier("turns").entries)
+    fps = ColumnarTier.from_entries(tg.getTier("FPs").entries if "FPs" in tg.tierNames else [])
+
+    r_idx = np.flatnonzero(turns.label_startswith("R"))
+    r_starts = turns.starts[r_idx]
+    r_ends = turns.ends[r_idx]
+    fp_lo, fp_hi = fps.spans(r_starts, r_ends)
+
+    columns = {col: [] for col in ACOUSTIC_COLUMNS[2:]}
+    for start, end, lo, hi in zip(r_starts.tolist(), r_ends.tolist(), fp_lo.tolist(), fp_hi.tolist()):
+        x = interval_samples(wav, start, end)
+        sum_squares, num_samples = energy(x)
+        f0s, num_frames = frame_f0s(x, wav.sample_rate)
+
+        # the FPs of the response are pooled: energy over all their samples, F0 over all their voiced frames
+        fp_sum_squares, fp_samples, fp_f0s = 0.0, 0, []
+        for i in range(lo, hi):
+            fp_x = interval_samples(wav, fps.starts[i], fps.ends[i])
+            fp_energy = energy(fp_x)
+            fp_sum_squares += fp_energy[0]
+            fp_samples += fp_energy[1]
+            fp_f0s.append(frame_f0s(fp_x, wav.sample_rate)[0])
+        fp_f0s = np.concatenate(fp_f0s) if fp_f0s else np.empty(0)
+
+        columns["DurationSec"].append(end - start)
+        columns["RMSdB"].append(rms_db(sum_squares, num_samples))
+        columns["EnergyPerSec"].append(energy_per_second(sum_squares, num_samples, wav.sample_rate))
+        columns["F0Hz"].append(float(np.median(f0s)) if len(f0s) else np.nan)
+        columns["VoicedRatio"].append(len(f0s) / num_frames if num_frames else 0.0)
+        columns["FPNum"].append(hi - lo)
+        columns["FPRMSdB"].append(rms_db(fp_sum_squares, fp_samples))
+        columns["FPF0Hz"].append(float(np.median(fp_f0s)) if len(fp_f0s) else np.nan)
+
+    results = Table(ACOUSTIC_COLUMNS)
+    results.add(
+        len(r_idx),
+        ParticipantID=participant_id,
+        QuestionNum=[label[1:] for label in turns.labels[r_idx].tolist()],
+        FPNum=np.array(columns.pop("FPNum"), dtype=np.int64),
+        **{col: round_values(np.array(values, dtype=np.float64)) for col, values in columns.items()},
+    )
+    return results
+
+
+# MAIN PIPELINE
+# Process one participant (runs in a worker process when jobs > 1): {participant_id}_preprocessed.TextGrid and {participant_id}.wav
+def process_participant(tg_path, wav_folder):
+    filename = os.path.basename(tg_path)
+    participant_id = filename.split("_")[0]  # e.g., 02 from "02_preprocessed.TextGrid"
+    wav_path = os.path.join(wav_folder, f"{participant_id}.wav")
+
+    print(f"Processing: {filename}, {os.path.basename(wav_path)}")
+
+    tg = read_textgrid(tg_path, ["turns", "FPs"], include_empty=False)
+    if "turns" not in tg.tierNames:
+        raise ValueError(f"No 'turns' tier found in {filename}")
+    wav = open_wav(wav_path)
+
+    with instrumentation.stage("extract_acoustics", file=tg_path) as s:
+        results = extract_acoustics(tg, wav, participant_id)
+        s.items = len(results)
+    return results
+
+
+def process_folder(textgrid_folder, wav_folder, output_folder, jobs=1, output_format="csv"):
+    # only the annotated files (not the _extracted copies extracting_features.py saves next to them)
+    textgrid_paths = sorted(glob.glob(os.path.join(textgrid_folder, "*_preprocessed.TextGrid")))
+
+    # a failing participant is reported and skipped, the others are still processed
+    results = {}
+    failed = []
+    if jobs > 1:
+        task = instrumentation.traced(process_participant) if instrumentation.is_enabled() else process_participant
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(task, tg_path, wav_folder): tg_path for tg_path in textgrid_paths}
+            for future in as_completed(futures):
+                tg_path = futures[future]
+                try:
+                    results[tg_path] = instrumentation.result(future.result())
+                except Exception as e:
+                    print(f"Error processing {os.path.basename(tg_path)}: {e}")
+                    failed.append(tg_path)
+    else:
+        for tg_path in textgrid_paths:
+            try:
+                results[tg_path] = process_participant(tg_path, wav_folder)
+            except Exception as e:
+                print(f"Error processing {os.path.basename(tg_path)}: {e}")
+                failed.append(tg_path)
+
+    # collect the results in file order
+    all_acoustics = Table(ACOUSTIC_COLUMNS)
+    for tg_path in textgrid_paths:
+        if tg_path in results:
+            all_acoustics.extend(results[tg_path])
+
+    os.makedirs(output_folder, exist_ok=True)
+    with instrumentation.stage("write_table", file="Acoustics", items=len(all_acoustics)):
+        save_table(all_acoustics, output_folder, "Acoustics", output_format)
+
+    print(f"Acoustics: {len(all_acoustics)} rows")
+    print(f"Results saved to: {output_folder}")
+
+    if failed:
+        print(f"{len(failed)} file(s) failed: {', '.join(os.path.basename(path) for path in sorted(failed))}")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract acoustic measures per response from the .wav files (joins the other tables on ParticipantID and QuestionNum)")
+    parser.add_argument("textgrid_folder", metavar="TextGridFolder")
+    parser.add_argument("wav_folder", metavar="WavFolder")
+    parser.add_argument("output_folder", metavar="OutputFolder")
+    parser.add_argument("--jobs", type=int, default=1, help="number of participants processed in parallel (default: 1)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="csv", help="format of the output table (default: csv)")
+    parser.add_argument("--trace", help="record the time and memory of each stage, save them to this JSON file and print a summary")
+    args = parser.parse_args()
+
+    if args.trace:
+        instrumentation.enable()
+
+    failed = process_folder(args.textgrid_folder, args.wav_folder, args.output_folder, jobs=args.jobs, output_format=args.format)
+
+    if args.trace:
+        instrumentation.save_trace(args.trace)
+        instrumentation.print_summary()
+        print(f"Trace saved to: {args.trace}")
+    sys.exit(1 if failed else 0)
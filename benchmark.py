@@ -0,0 +1,200 @@
+import io
+import os
+import time
+import glob
+import shutil
+import random
+import argparse
+import tempfile
+import contextlib
+import tracemalloc
+import pandas as pd
+from praatio import textgrid
+import extracting_features as ef
+from checkLabel import EXPECTED_PAIRS, check_turns
+from MFA_pipeline import from_pauses
+from textgrid_reader import read_textgrid
+
+# Synthetic corpus: per participant a preprocessed TextGrid (turns, utterances, FPs), the MFA output
+# it would have been made from (words, phones) and one condition sheet for all participants
+FP_FORMS = ("음", "어", "그", "저")
+WORDS = ("안녕", "하세요", "저는", "그래서", "학교에", "갔어요", "네", "아니요")
+NUM_ITEMS = 50
+
+
+def generate_participant(rnd, turns, fp_density):
+    # turns: number of Q/R pairs (in the order Q/R010, Q/R011, ..., Q/R504), fp_density: FPs per second of response
+    turn_entries, utterances, fps, words, phones = [], [], [], [], []
+    t = 0.5
+    for q_label, r_label in EXPECTED_PAIRS[:turns]:
+        q_start = t
+        q_end = q_start + rnd.uniform(1, 3)
+        r_start = q_end + rnd.uniform(0.2, 1.5)
+        r_end = r_start + rnd.uniform(1, 8)
+        turn_entries.append((q_start, q_end, q_label))
+        turn_entries.append((r_start, r_end, r_label))
+
+        # utterances (and the words and phones they consist of) with short pauses in between
+        for start, end in ((q_start, q_end), (r_start, r_end)):
+            x = start
+            while x < end - 0.3:
+                y = min(end, x + rnd.uniform(0.3, 2))
+                utterance_words = [rnd.choice(WORDS) for _ in range(rnd.randint(1, 4))]
+                utterances.append((x, y, "".join(utterance_words)))
+                # shared boundaries, so neighbouring words and phones never overlap by a rounding error
+                bounds = [x + (y - x) * k / (3 * len(utterance_words)) for k in range(3 * len(utterance_words))] + [y]
+                for k, word in enumerate(utterance_words):
+                    words.append((bounds[3 * k], bounds[3 * k + 3], word))
+                    phones.extend((bounds[j], bounds[j + 1], "p") for j in range(3 * k, 3 * k + 3))
+                x = y + rnd.uniform(0.25, 0.6)
+
+        # FPs within the response, some of them turn-initial
+        num_fps = min(int((r_end - r_start) / 0.5), round(rnd.expovariate(1) * fp_density * (r_end - r_start)))
+        slots = sorted(rnd.sample(range(int((r_end - r_start) / 0.5)), num_fps))
+        for slot in slots:
+            fp_start = r_start + slot * 0.5
+            fps.append((fp_start, fp_start + rnd.uniform(0.1, 0.45), rnd.choice(FP_FORMS)))
+
+        t = r_end + rnd.uniform(0.3, 1.5)
+    return turn_entries, utterances, fps, words, phones, t + 1
+
+
+def generate_corpus(folder, participants, turns=len(EXPECTED_PAIRS), fp_density=0.3, seed=0):
+    rnd = random.Random(seed)
+    tg_folder = os.path.join(folder, "textgrids")
+    aligned_folder = os.path.join(folder, "aligned")
+    os.makedirs(tg_folder, exist_ok=True)
+    os.makedirs(aligned_folder, exist_ok=True)
+
+    for p in range(1, participants + 1):
+        participant_id = f"{p:02d}"
+        turn_entries, utterances, fps, words, phones, max_t = generate_participant(rnd, turns, fp_density)
+
+        tg = textgrid.Textgrid()
+        tg.addTier(textgrid.IntervalTier("turns", turn_entries, 0, max_t))
+        tg.addTier(textgrid.IntervalTier("utterances", utterances, 0, max_t))
+        tg.addTier(textgrid.IntervalTier("FPs", fps, 0, max_t))
+        tg.save(os.path.join(tg_folder, f"{participant_id}_preprocessed.TextGrid"), format="short_textgrid", includeBlankSpaces=True)
+
+        # MFA writes the long format
+        mfa_tg = textgrid.Textgrid()
+        mfa_tg.addTier(textgrid.IntervalTier("words", words, 0, max_t))
+        mfa_tg.addTier(textgrid.IntervalTier("phones", phones, 0, max_t))
+        mfa_tg.save(os.path.join(aligned_folder, f"{participant_id}.TextGrid"), format="long_textgrid", includeBlankSpaces=True)
+
+    # condition sheet: one column per participant (row 0: list name, row 1: participant ID, row n + 1: condition of item n)
+    rows = [[f"List{p}" for p in range(1, participants + 1)], list(range(1, participants + 1))]
+    rows += [[rnd.choice("TD") for _ in range(participants)] for _ in range(NUM_ITEMS)]
+    condition_excel = os.path.join(folder, "conditions.xlsx")
+    pd.DataFrame(rows).to_excel(condition_excel, header=False, index=False)
+    return tg_folder, aligned_folder, condition_excel
+
+
+# Best wall time of `repeat` runs, then the peak traced memory of one more run (tracemalloc slows the run down)
+def measure(func, repeat=1, setup=None):
+    times = []
+    for _ in range(repeat + 1):
+        args = setup() if setup is not None else ()
+        traced = len(times) == repeat
+        if traced:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            func(*args)
+        elapsed = time.perf_counter() - start
+        if traced:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            times.append(elapsed)
+    return min(times), peak / 1e6
+
+
+def benchmark_corpus(folder, repeat=1):
+    tg_folder = os.path.join(folder, "textgrids")
+    aligned_folder = os.path.join(folder, "aligned")
+    condition_excel = os.path.join(folder, "conditions.xlsx")
+    tg_paths = sorted(glob.glob(os.path.join(tg_folder, "*.TextGrid")))
+    aligned_paths = sorted(glob.glob(os.path.join(aligned_folder, "*.TextGrid")))
+
+    # the extractors run on TextGrids that are already in memory (with the condition tier)
+    condition_index = ef.load_condition_index(condition_excel)
+    prepared = []
+    for tg_path in tg_paths:
+        participant_id = os.path.basename(tg_path).split("_")[0]
+        list_num = ef.get_list_num(participant_id, condition_index)
+        tg = ef.add_condition_tier(read_textgrid(tg_path), list_num, condition_index)
+        prepared.append((tg, participant_id, list_num))
+
+    def run_extractor(extractor):
+        return lambda: [extractor(tg, participant_id, list_num) for tg, participant_id, list_num in prepared]
+
+    merged_folder = os.path.join(folder, "merged")
+    os.makedirs(merged_folder, exist_ok=True)
+
+    def run_from_pauses():
+        for path in aligned_paths:
+            from_pauses(path, os.path.join(merged_folder, os.path.basename(path)))
+
+    def run_check_turns():
+        for path in tg_paths:
+            check_turns(path)
+
+    # process_files writes the _extracted files next to its input, so every run gets a fresh copy
+    def fresh_input():
+        input_folder = os.path.join(folder, "input")
+        shutil.rmtree(input_folder, ignore_errors=True)
+        shutil.copytree(tg_folder, input_folder)
+        return input_folder, condition_excel, os.path.join(folder, "output")
+
+    targets = [
+        ("extract_rl", run_extractor(ef.extract_rl), None),
+        ("extract_sr", run_extractor(ef.extract_sr), None),
+        ("extract_fr", run_extractor(ef.extract_fr), None),
+        ("extract_fp_form_pos", run_extractor(ef.extract_fp_form_pos), None),
+        ("from_pauses", run_from_pauses, None),
+        ("check_turns", run_check_turns, None),
+        ("process_files", ef.process_files, fresh_input),
+    ]
+
+    results = []
+    for name, func, setup in targets:
+        seconds, peak_mb = measure(func, repeat, setup)
+        results.append({"Function": name, "Files": len(tg_paths), "Seconds": round(seconds, 4), "PeakMB": round(peak_mb, 2)})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the extraction and post-alignment steps on synthetic corpora of different sizes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 20, 80], help="numbers of participants (default: 5 20 80)")
+    parser.add_argument("--turns", type=int, default=len(EXPECTED_PAIRS), help=f"Q/R pairs per participant (default: {len(EXPECTED_PAIRS)})")
+    parser.add_argument("--fp-density", type=float, default=0.3, help="FPs per second of response (default: 0.3)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per function, the best one is reported (default: 3)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus-dir", help="keep the generated corpora here instead of a temporary folder")
+    parser.add_argument("--output", help="also save the results to this CSV file")
+    args = parser.parse_args()
+
+    if not 1 <= args.turns <= len(EXPECTED_PAIRS):
+        parser.error(f"--turns must be between 1 and {len(EXPECTED_PAIRS)}")
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    base_dir = args.corpus_dir or tempfile.mkdtemp(prefix="benchmark_")
+    all_results = []
+    try:
+        for size in args.sizes:
+            folder = os.path.join(base_dir, f"corpus_{size}")
+            print(f"Generating {size} participants, {args.turns} turns each, {args.fp_density} FPs/s...")
+            generate_corpus(folder, size, args.turns, args.fp_density, args.seed)
+            for result in benchmark_corpus(folder, args.repeat):
+                all_results.append({"Participants": size, "Turns": args.turns, "FPDensity": args.fp_density, **result})
+    finally:
+        if args.corpus_dir is None:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    results_df = pd.DataFrame(all_results)
+    print(results_df.to_string(index=False))
+    if args.output:
+        results_df.to_csv(args.output, index=False)
+        print(f"Results saved to: {args.output}")
@@ -1,51 +1,14 @@
-from praatio import textgrid
-
-def check_turns(textgrid_path):
-    tg = textgrid.openTextgrid(textgrid_path, includeEmptyIntervals=False)
-    if "turns" not in tg.tierNames:
-        raise ValueError("No 'turns' tier found in TextGrid")
-    turns_tier = tg.getTier("turns")
-    entries = turns_tier.entries
-
-    # Check if each label only occurs once
-    label_counts = {}
-    label_dup_found = False
-
-    for entry in entries:
-        label = entry[2]
-        if label in label_counts:
-            label_counts[label] += 1
-            label_dup_found = True
-        else:
-            label_counts[label] = 1
-
-    for label, count in label_counts.items():
-        if count > 1:
-            print(f"Label '{label}' occurs {count} times")
-    
-    if not label_dup_found:
-        print("No duplicate labels found.")
-
-    
-    # nth (even number) label & n+1th (odd number) label should have the same numbering in their labels
-    for i in range(0, len(entries) - 1, 2):
-        q_label = entries[i][2]
-        r_label = entries[i + 1][2]
-        invalid_pairs = False
-
-        if not (q_label.startswith("Q") and r_label.startswith("R")):
-            print(f"Invalid labels at positions {entries[i][0]} and {entries[i + 1][0]}: {q_label}, {r_label}")
-            invalid_pairs = True
-        elif q_label[1:] != r_label[1:]:
-            print(f"Mismatch: {q_label} vs {r_label} at positions {entries[i][0]} and {entries[i + 1][0]}")
-            invalid_pairs = True
-
-    if not invalid_pairs:
-        print("All existing Q/R pairs are valid.")
-
-    # Check if all Q/R pairs from Q/R010 to Q/R054 are present
-    existing_labels = set([entry[2] for entry in entries])
+import os
+import sys
+import csv
+import glob
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from textgrid_reader import read_textgrid
 
+# Expected Q/R pairs from Q/R010 to Q/R504 (built once)
+def get_expected_pairs():
     expected_pairs = []
     for i in range(1, 51):  # Q/R010 ~ Q/R500
         base = f"{i:02d}0"
@@ -57,18 +20,157 @@ def check_turns(textgrid_path):
             sub_q = f"Q{i:02d}{j}"
             sub_r = f"R{i:02d}{j}"
             expected_pairs.append((sub_q, sub_r))
+    return expected_pairs
+
+EXPECTED_PAIRS = get_expected_pairs()
+
+
+# Validate the entries of a 'turns' tier in one pass and return the problems found
+def validate_turns(entries):
+    label_counts = {}
+    invalid_pairs = []
+    mismatched_pairs = []
+
+    for i, entry in enumerate(entries):
+        label = entry[2]
+        label_counts[label] = label_counts.get(label, 0) + 1
+
+        # nth (even number) label & n+1th (odd number) label should have the same numbering in their labels
+        if i % 2 == 1:
+            q_entry = entries[i - 1]
+            q_label, r_label = q_entry[2], label
+            pair = {"q_label": q_label, "r_label": r_label, "q_start": q_entry[0], "r_start": entry[0]}
+            if not (q_label.startswith("Q") and r_label.startswith("R")):
+                invalid_pairs.append(pair)
+            elif q_label[1:] != r_label[1:]:
+                mismatched_pairs.append(pair)
+
+    # Check if all Q/R pairs from Q/R010 to Q/R054 are present
+    missing_pairs = [
+        {"q_label": q, "q_found": q in label_counts, "r_label": r, "r_found": r in label_counts}
+        for q, r in sorted(EXPECTED_PAIRS)
+        if q not in label_counts or r not in label_counts
+    ]
+
+    duplicates = {label: count for label, count in label_counts.items() if count > 1}
+    return {
+        "duplicates": duplicates,
+        "invalid_pairs": invalid_pairs,
+        "mismatched_pairs": mismatched_pairs,
+        "missing_pairs": missing_pairs,
+        # missing pairs are reported, but only duplicates and broken pairs make a file invalid
+        "valid": not (duplicates or invalid_pairs or mismatched_pairs),
+    }
+
 
-    missing = []
-    for q, r in expected_pairs:
-        if q not in existing_labels or r not in existing_labels:
-            missing.append((q, r))
+def validate_file(textgrid_path):
+    result = {"file": textgrid_path, "error": None}
+    try:
+        tg = read_textgrid(textgrid_path, ["turns"], include_empty=False)
+        if "turns" not in tg.tierNames:
+            raise ValueError("No 'turns' tier found in TextGrid")
+        result.update(validate_turns(tg.getTier("turns").entries))
+    except Exception as e:
+        result.update({"error": str(e), "valid": False})
+    return result
 
+
+def check_turns(textgrid_path):
+    result = validate_file(textgrid_path)
+    if result["error"] is not None:
+        raise ValueError(result["error"])
+    print_result(result)
+    return result
+
+
+def print_result(result):
+    # Check if each label only occurs once
+    for label, count in result["duplicates"].items():
+        print(f"Label '{label}' occurs {count} times")
+
+    if not result["duplicates"]:
+        print("No duplicate labels found.")
+
+    for pair in result["invalid_pairs"]:
+        print(f"Invalid labels at positions {pair['q_start']} and {pair['r_start']}: {pair['q_label']}, {pair['r_label']}")
+    for pair in result["mismatched_pairs"]:
+        print(f"Mismatch: {pair['q_label']} vs {pair['r_label']} at positions {pair['q_start']} and {pair['r_start']}")
+
+    if not (result["invalid_pairs"] or result["mismatched_pairs"]):
+        print("All existing Q/R pairs are valid.")
+
+    missing = result["missing_pairs"]
     if missing:
         print(f"{len(missing)} missing pairs in total")
-        for q, r in sorted(missing):
-            q_status = "not found" if q not in existing_labels else "found"
-            r_status = "not found" if r not in existing_labels else "found"
-            print(f"{q} {q_status}, {r} {r_status}")
+        for pair in missing:
+            q_status = "found" if pair["q_found"] else "not found"
+            r_status = "found" if pair["r_found"] else "not found"
+            print(f"{pair['q_label']} {q_status}, {pair['r_label']} {r_status}")
     else:
         print("All expected Q/R pairs found.")
-    
\ No newline at end of file
+
+
+# Validate many TextGrid files, in parallel processes if jobs > 1 (results are in the order of the paths)
+def validate_files(textgrid_paths, jobs=1):
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(validate_file, textgrid_paths))
+    return [validate_file(path) for path in textgrid_paths]
+
+
+def validate_folder(textgrid_folder, jobs=1):
+    # the _extracted copies extracting_features.py saves next to the annotated files are not validated again
+    textgrid_paths = sorted(
+        path for path in glob.glob(os.path.join(textgrid_folder, "*.TextGrid"))
+        if not path.endswith("_extracted.TextGrid")
+    )
+    return validate_files(textgrid_paths, jobs)
+
+
+# Write the results as JSON (one object per file) or CSV (one row per problem), depending on the extension
+def write_report(results, report_path):
+    if report_path.endswith(".json"):
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        return
+
+    with open(report_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["File", "Problem", "Labels", "Detail"])
+        for result in results:
+            filename = os.path.basename(result["file"])
+            if result["error"] is not None:
+                writer.writerow([filename, "error", "", result["error"]])
+                continue
+            for label, count in result["duplicates"].items():
+                writer.writerow([filename, "duplicate", label, f"occurs {count} times"])
+            for pair in result["invalid_pairs"]:
+                writer.writerow([filename, "invalid_pair", f"{pair['q_label']} {pair['r_label']}", f"at {pair['q_start']} and {pair['r_start']}"])
+            for pair in result["mismatched_pairs"]:
+                writer.writerow([filename, "mismatch", f"{pair['q_label']} {pair['r_label']}", f"at {pair['q_start']} and {pair['r_start']}"])
+            for pair in result["missing_pairs"]:
+                missing = " ".join(label for label, found in [(pair["q_label"], pair["q_found"]), (pair["r_label"], pair["r_found"])] if not found)
+                writer.writerow([filename, "missing", f"{pair['q_label']} {pair['r_label']}", f"not found: {missing}"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the Q/R labels of the 'turns' tier in a folder of TextGrid files")
+    parser.add_argument("textgrid_folder", metavar="TextGridFolder")
+    parser.add_argument("--jobs", type=int, default=1, help="number of files checked in parallel (default: 1)")
+    parser.add_argument("--report", help="write the results to this .json or .csv file")
+    args = parser.parse_args()
+
+    results = validate_folder(args.textgrid_folder, args.jobs)
+    for result in results:
+        print(f"\n{os.path.basename(result['file'])}")
+        if result["error"] is not None:
+            print(f"Error: {result['error']}")
+        else:
+            print_result(result)
+
+    if args.report:
+        write_report(results, args.report)
+
+    invalid = [result for result in results if not result["valid"]]
+    print(f"\n{len(results) - len(invalid)} of {len(results)} files valid.")
+    sys.exit(1 if invalid else 0)
@@ -1,342 +1,710 @@
 import os
 import sys
 import glob
+import argparse
+import hashlib
+import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+import numpy as np
 import pandas as pd
 from praatio import textgrid
+import textgrid_reader
+import instrumentation
+from textgrid_reader import read_textgrid
+from checkLabel import validate_files
+
+# STEP 0: Load the condition sheet as an index: participant ID -> list number -> item number -> condition
+class ConditionIndex:
+    def __init__(self, list_nums, conditions, sha256=None):
+        self.list_nums = list_nums    # zero-padded participant ID -> list number (column of the sheet)
+        self.conditions = conditions  # list number -> column values (row 0: list name, row 1: participant ID, row n + 1: item n)
+        self.sha256 = sha256          # hash of the workbook the index was built from
+
+    @classmethod
+    def from_dataframe(cls, condition_df, sha256=None):
+        list_nums = {}
+        conditions = {}
+        for col in condition_df.columns:
+            values = condition_df[col].tolist()
+            list_nums.setdefault(str(values[1]).zfill(2), col)  # index 1! (the first matching column wins)
+            conditions[col] = values
+        return cls(list_nums, conditions, sha256)
+
+    def list_num(self, participant_id):
+        try:
+            return self.list_nums[str(participant_id).zfill(2)]
+        except KeyError:
+            raise ValueError(f"No list number found for participant ID: {participant_id}") from None
+
+    def condition(self, list_num, item_num):
+        # the first row is the list name and the second the participant ID, so item n is in row n + 1
+        return self.conditions[list_num][item_num + 1]
+
+
+def load_condition_index(condition_excel):
+    # reading the workbook is slow, so the index is kept next to it in a sidecar file
+    # which is rebuilt when the workbook changes (same mtime and size, or else same hash)
+    sidecar_path = f"{condition_excel}.index.pkl"
+    stat = os.stat(condition_excel)
+
+    cached = None
+    if os.path.exists(sidecar_path):
+        try:
+            with open(sidecar_path, "rb") as f:
+                cached = pickle.load(f)
+        except Exception as e:
+            print(f"Ignoring unreadable condition index {sidecar_path}: {e}")
+
+    if cached is not None and (cached["mtime_ns"], cached["size"]) == (stat.st_mtime_ns, stat.st_size):
+        return ConditionIndex(cached["list_nums"], cached["conditions"], cached["sha256"])
+
+    sha256 = file_hash(condition_excel)
+    if cached is not None and cached["sha256"] == sha256:
+        index = ConditionIndex(cached["list_nums"], cached["conditions"], cached["sha256"])
+    else:
+        condition_df = pd.read_excel(condition_excel, header=None)
+        index = ConditionIndex.from_dataframe(condition_df, sha256)
+
+    # plain dicts and lists only, so the sidecar can be read no matter how this module was imported
+    sidecar = {
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": index.sha256,
+        "list_nums": index.list_nums,
+        "conditions": index.conditions,
+    }
+    try:
+        with open(sidecar_path, "wb") as f:
+            pickle.dump(sidecar, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        print(f"Could not save condition index {sidecar_path}: {e}")
+    return index
+
 
 # STEP 1: Add 'condition' tier to the TextGrid with response condition labels
-def get_list_num(participant_id, condition_df):
+def get_list_num(participant_id, condition_index):
     # get the list for each participant
-    for col in condition_df.columns:
-        id_in_col = str(condition_df[col].iloc[1]).zfill(2)  # index 1!
-        if id_in_col == str(participant_id).zfill(2):
-            return col
-    raise ValueError(f"No list number found for participant ID: {participant_id}")
-
-def add_condition_tier(tg, list_num, condition_df):
-    new_entries = []
-
-    turns_tier = tg.getTier("turns")
-    entries = turns_tier.entries
-
-    for entry in entries:
-        label = entry[2]
-        if label.startswith("R"):
-            # extract the question number (e.g., R010 -> 1) and then adjust for index by adding 1 (because the first row is participant ID)
-            rownum = int(label[1:3]) + 1
-            condition = condition_df[list_num].iloc[rownum]  # Look up the condition (T or D)
-            new_entries.append((entry[0], entry[1], condition))
-
-    tg.addTier(textgrid.IntervalTier(name="condition", entries=new_entries, minT=0, maxT=tg.maxTimestamp))
-    return tg
+    return condition_index.list_num(participant_id)
 
+def add_condition_tier(tg, list_num, condition_index):
+    with instrumentation.stage("condition_tier") as s:
+        new_entries = []
 
-# STEP 2: Extract numerical data from TextGrid files
-# Extract response latency (RL)
-def extract_rl(tg, participant_id, list_num):
-    results = []
-    turns_tier = tg.getTier("turns")
-    condition_tier = tg.getTier("condition")
+        turns_tier = tg.getTier("turns")
+        entries = turns_tier.entries
 
-    entries = turns_tier.entries
+        for entry in entries:
+            label = entry[2]
+            if label.startswith("R"):
+                # extract the question number (e.g., R010 -> 1) and look up the condition (T or D)
+                condition = condition_index.condition(list_num, int(label[1:3]))
+                new_entries.append((entry[0], entry[1], condition))
 
-    for i in range(0, len(entries) - 1, 2):
-        q_entry = entries[i]
-        r_entry = entries[i + 1]
+        condition_tier = textgrid.IntervalTier(name="condition", entries=new_entries, minT=0, maxT=tg.maxTimestamp)
+        tg.addTier(condition_tier)
 
-        if not (q_entry[2].startswith("Q") and r_entry[2].startswith("R")):
-            continue
+        # build the condition lookup once here so the extractors don't have to scan the tier
+        tg.condition_lookup = ConditionLookup(condition_tier.entries)
+        s.items = len(new_entries)
+    return tg
 
-        # RL in ms
-        rl = round((r_entry[0] - q_entry[1]) * 1000, 3)
-        question_num = q_entry[2][1:]
-        
-        # find the condition for this response based on start time
-        cond = None
-        for cond_entry in condition_tier.entries:
-            if abs(cond_entry[0] - r_entry[0]) < 1e-6:
-                cond = cond_entry[2]
-                break
-        
+
+# Columnar view of one tier: starts and ends as float64 arrays, labels as an object array
+# (interval tiers are sorted and non-overlapping, so both starts and ends are sorted)
+class ColumnarTier:
+    def __init__(self, starts, ends, labels):
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.ends = np.asarray(ends, dtype=np.float64)
+        self.labels = np.asarray(labels, dtype=object)
+
+    @classmethod
+    def from_entries(cls, entries):
+        entries = list(entries)
+        labels = np.empty(len(entries), dtype=object)
+        labels[:] = [entry[2] for entry in entries]
+        return cls([entry[0] for entry in entries], [entry[1] for entry in entries], labels)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def label_startswith(self, prefix):
+        return np.array([label.startswith(prefix) for label in self.labels], dtype=bool)
+
+    def label_lengths(self):
+        return np.fromiter((len(label) for label in self.labels), dtype=np.int64, count=len(self))
+
+    def spans(self, starts, ends):
+        # index ranges [lo, hi) of the intervals fully inside each [start, end]:
+        # first start >= start up to last end <= end
+        lo = np.searchsorted(self.starts, starts, side="left")
+        hi = np.searchsorted(self.ends, ends, side="right")
+        return lo, np.maximum(lo, hi)
+
+
+# round() each value like the per-row code did (np.round can differ in the last digit)
+def round_values(values, ndigits=3):
+    return [round(value, ndigits) for value in values.tolist()]
+
+
+# Lookup of the condition label by response start time
+# (keys are start times rounded to microseconds, neighbouring keys are checked for the 1e-6 tolerance)
+class ConditionLookup:
+    def __init__(self, entries):
+        self.buckets = {}
+        for order, entry in enumerate(entries):
+            self.buckets.setdefault(round(entry[0] * 1e6), []).append((order, entry))
+
+    def get(self, start):
+        key = round(start * 1e6)
+        matches = [
+            (order, entry[2])
+            for k in (key - 1, key, key + 1)
+            for order, entry in self.buckets.get(k, [])
+            if abs(entry[0] - start) < 1e-6
+        ]
+        # same result as a linear scan: the first matching entry of the tier
+        return min(matches)[1] if matches else None
+
+
+def get_condition_lookup(tg):
+    lookup = getattr(tg, "condition_lookup", None)
+    if lookup is None:
+        lookup = ConditionLookup(tg.getTier("condition").entries)
+        tg.condition_lookup = lookup
+    return lookup
+
+
+# Column-oriented accumulator for result rows: every column is a list of NumPy chunks instead of one dict per row
+class Table:
+    def __init__(self, columns):
+        self.chunks = {col: [] for col in columns}
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def add(self, n, **values):
+        # add n rows; a value is either a sequence of n values or a scalar used for all n rows
+        if set(values) != set(self.chunks):
+            raise ValueError(f"Expected columns {list(self.chunks)}, got {list(values)}")
+        for col, value in values.items():
+            self.chunks[col].append(_column_chunk(value, n))
+        self.length += n
+
+    def extend(self, other):
+        for col in self.chunks:
+            self.chunks[col].extend(other.chunks[col])
+        self.length += len(other)
+
+    def columns(self):
+        return {col: _concat_chunks(chunks) for col, chunks in self.chunks.items()}
+
+    @classmethod
+    def from_columns(cls, columns):
+        table = cls(columns)
+        table.add(len(next(iter(columns.values()), [])), **columns)
+        return table
+
+    def to_frame(self):
+        return pd.DataFrame(self.columns(), copy=False)
+
+    def rows(self):
+        return self.to_frame().to_dict("records")
+
+
+def _column_chunk(value, n):
+    if isinstance(value, np.ndarray):
+        return value
+    if isinstance(value, (list, tuple)):
+        # strings are kept as objects (not fixed-width unicode arrays)
+        is_text = any(isinstance(item, str) for item in value)
+        return np.asarray(value, dtype=object if is_text else None)
+    return np.full(n, value, dtype=object if isinstance(value, str) else None)
+
+
+def _concat_chunks(chunks):
+    # empty chunks (e.g. of a file without responses) are float64 and would turn integer columns into floats
+    chunks = [chunk for chunk in chunks if len(chunk)] or chunks[:1]
+    if not chunks:
+        return np.empty(0, dtype=object)
+    return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+
+RL_COLUMNS = ("ParticipantID", "ListNum", "QuestionNum", "ResponseCond", "RLMilSec")
+SR_COLUMNS = ("ParticipantID", "ListNum", "QuestionNum", "ResponseCond", "DurationSec", "SyllNum", "SR")
+FR_CONDITION_COLUMNS = ("ParticipantID", "ListNum", "ResponseCond", "QuestionType", "SumDurationMin", "Freq", "FR")
+FR_ITEM_COLUMNS = ("ParticipantID", "ListNum", "ItemID", "ResponseCond", "SumDurationMin", "Freq", "FR")
+FR_TURN_COLUMNS = ("ParticipantID", "ListNum", "QuestionNum", "ResponseCond", "QuestionType", "DurationMin", "Freq", "FR")
+FR_FACT_COLUMNS = ("ParticipantID", "ListNum", "QuestionNum", "ItemID", "ResponseCond", "QuestionType", "DurationSec", "Freq")
+FP_FORM_POS_COLUMNS = ("ParticipantID", "ListNum", "QuestionNum", "ResponseCond", "Form", "Position")
+
+
+RESULT_NAMES = ("ResponseLatency", "SpeakingRate", "FP_Rate_Condition", "FP_Rate_Item", "FP_Rate_Turn", "FP_Form_Position", "FP_Turn_Facts")
+
+
+# Accept a TextGrid (praatio or textgrid_reader) or a dict of tier name -> tier object or (start, end, label) entries
+def as_textgrid(tiers):
+    if hasattr(tiers, "getTier"):
+        return tiers
+    tg = textgrid_reader.LightTextgrid(0, 0)
+    for name, tier in tiers.items():
+        if not hasattr(tier, "entries"):
+            # praatio sorts raw entries and rejects overlapping intervals; the array lookups rely on both
+            entries = [tuple(entry) for entry in tier]
+            tier = textgrid.IntervalTier(name, entries, 0, max((entry[1] for entry in entries), default=0))
+        max_t = getattr(tier, "maxTimestamp", getattr(tier, "maxT", 0))
+        tg.addTier(textgrid_reader.Tier(name, [tuple(entry) for entry in tier.entries], 0, max_t, textgrid_reader.INTERVAL_TIER))
+        tg.maxTimestamp = max(tg.maxTimestamp, max_t)
+    return tg
+
+
+# STEP 2: Extract numerical data from TextGrid files
+# Extract RL, SR, FR and FP forms/positions for all turns at once with array operations
+def extract_all(tg, participant_id, list_num):
+    tg = as_textgrid(tg)
+    turns = ColumnarTier.from_entries(tg.getTier("turns").entries)
+    utterances = ColumnarTier.from_entries(tg.getTier("utterances").entries)
+    fps = ColumnarTier.from_entries(tg.getTier("FPs").entries)
+    condition_lookup = get_condition_lookup(tg)
+
+    # responses
+    is_q = turns.label_startswith("Q")
+    r_idx = np.flatnonzero(turns.label_startswith("R"))
+    r_starts = turns.starts[r_idx]
+    r_ends = turns.ends[r_idx]
+    r_labels = turns.labels[r_idx].tolist()
+    question_nums = [label[1:] for label in r_labels]
+
+    # find the condition for each response based on start time
+    conds = [condition_lookup.get(start) for start in r_starts.tolist()]
+    for question_num, cond in zip(question_nums, conds):
         if cond is None:
             raise ValueError(f"Condition not found for response {question_num} in participant {participant_id}, list {list_num}")
 
-        results.append({
-            "ParticipantID": participant_id,
-            "ListNum": list_num,
-            "QuestionNum": question_num,
-            "ResponseCond": cond,
-            "RLMilSec": rl
-        })
+    with instrumentation.stage("extract_rl", file=participant_id) as s:
+        # RL in ms: only for Q/R pairs at positions (even, odd)
+        is_pair = (r_idx % 2 == 1) & is_q[r_idx - 1]
+        pair_q_idx = r_idx[is_pair] - 1
+        rls = round_values((r_starts[is_pair] - turns.ends[pair_q_idx]) * 1000)
+        pair_conds = [cond for cond, paired in zip(conds, is_pair.tolist()) if paired]
+
+        rl_results = Table(RL_COLUMNS)
+        rl_results.add(
+            len(rls),
+            ParticipantID=participant_id,
+            ListNum=list_num,
+            QuestionNum=[q_label[1:] for q_label in turns.labels[pair_q_idx].tolist()],
+            ResponseCond=pair_conds,
+            RLMilSec=rls,
+        )
+        s.items = len(rl_results)
+
+    with instrumentation.stage("extract_sr", file=participant_id) as s:
+        # duration of the responses in seconds
+        durations = round_values(r_ends - r_starts)
+        duration_arr = np.array(durations, dtype=np.float64)
+
+        # SR: characters of the utterances within each response interval (difference of cumulative label lengths)
+        utt_lo, utt_hi = utterances.spans(r_starts, r_ends)
+        cum_lengths = np.concatenate(([0], np.cumsum(utterances.label_lengths())))
+        syllable_nums = (cum_lengths[utt_hi] - cum_lengths[utt_lo]).tolist()
+
+        has_duration = duration_arr > 0
+        srs = np.divide(syllable_nums, duration_arr, out=np.zeros(len(r_idx)), where=has_duration)
+        srs = [sr if positive else 0 for sr, positive in zip(round_values(srs), has_duration.tolist())]
+
+        sr_results = Table(SR_COLUMNS)
+        sr_results.add(
+            len(r_idx),
+            ParticipantID=participant_id,
+            ListNum=list_num,
+            QuestionNum=question_nums,
+            ResponseCond=conds,
+            DurationSec=durations,
+            SyllNum=syllable_nums,
+            SR=srs,
+        )
+        s.items = len(sr_results)
+
+    with instrumentation.stage("extract_fp_form_pos", file=participant_id) as s:
+        # FPs within each response interval
+        fp_lo, fp_hi = fps.spans(r_starts, r_ends)
+        fp_counts = fp_hi - fp_lo
+
+        # flatten to one row per FP: the response it belongs to and its index in the FPs tier
+        fp_turn = np.repeat(np.arange(len(r_idx)), fp_counts)
+        fp_index = np.arange(fp_counts.sum()) - np.repeat(np.cumsum(fp_counts) - fp_counts - fp_lo, fp_counts)
+
+        # save their forms and positions (turn INItial or INTernal)
+        positions = np.where(fps.starts[fp_index] == r_starts[fp_turn], "INI", "INT").astype(object)
+
+        fp_results = Table(FP_FORM_POS_COLUMNS)
+        fp_results.add(
+            len(fp_index),
+            ParticipantID=participant_id,
+            ListNum=list_num,
+            QuestionNum=np.asarray(question_nums, dtype=object)[fp_turn],
+            ResponseCond=np.asarray(conds, dtype=object)[fp_turn],
+            Form=fps.labels[fp_index],
+            Position=positions,
+        )
+        s.items = len(fp_results)
+
+    with instrumentation.stage("extract_fr", file=participant_id) as s:
+        # FR: one fact row per response (FPs and duration in seconds), the FR tables are derived from these
+        fact_results = Table(FR_FACT_COLUMNS)
+        fact_results.add(
+            len(r_idx),
+            ParticipantID=participant_id,
+            ListNum=list_num,
+            QuestionNum=question_nums,
+            ItemID=[label[1:3] for label in r_labels],  # e.g., R010 -> 01
+            ResponseCond=conds,
+            QuestionType=["Main" if label.endswith("0") else "FollowUp" for label in r_labels],
+            DurationSec=durations,
+            Freq=fp_counts,
+        )
+        s.items = len(fact_results)
+
+    return rl_results, sr_results, fact_results, fp_results
+
+
+# FP rate per group of response facts: summed duration in minutes, number of FPs and FPs per minute
+# (by=() gives one corpus-wide row; any grouping of the fact columns works, e.g. per participant or per list)
+def fp_rate(facts, by=()):
+    by = list(by)
+    if by:
+        # groups numbered in order of first appearance
+        codes = facts.groupby(by, sort=False, dropna=False).ngroup().to_numpy()
+        n_groups = codes.max() + 1 if len(codes) else 0
+        keys = facts[by].iloc[np.unique(codes, return_index=True)[1]]
+    else:
+        codes = np.zeros(len(facts), dtype=np.int64)
+        n_groups = 1
+        keys = pd.DataFrame(index=[0])
+
+    # the durations are added up row by row (like the per-row code did), since pandas' compensated sum
+    # can differ in the last digit and the sums are rounded to 3 decimals
+    duration_sec = np.zeros(n_groups)
+    np.add.at(duration_sec, codes, facts["DurationSec"].to_numpy(dtype=np.float64))
+    freq = np.bincount(codes, weights=facts["Freq"].to_numpy(dtype=np.int64), minlength=n_groups).astype(np.int64)
+    return _with_rate(keys, duration_sec, freq, "SumDurationMin")
+
+
+def _with_rate(keys, duration_sec, freq, duration_col):
+    # numeric even without any facts (the columns of an empty table are object arrays)
+    duration_min = np.array(round_values(np.asarray(duration_sec, dtype=np.float64) / 60), dtype=np.float64)
+    freq = np.asarray(freq, dtype=np.int64)
+    has_duration = duration_min > 0
+    fr = np.divide(freq, duration_min, out=np.zeros(len(freq)), where=has_duration)
+    result = keys.reset_index(drop=True)
+    result[duration_col] = duration_min
+    result["Freq"] = freq
+    result["FR"] = [rate if positive else 0 for rate, positive in zip(round_values(fr), has_duration.tolist())]
+    return result
+
+
+# Derive the per condition, per item and per turn FP rate tables from the response facts
+def fr_tables(facts):
+    cond_results = fp_rate(facts, FR_CONDITION_COLUMNS[:4])
+    item_results = fp_rate(facts, FR_ITEM_COLUMNS[:4])
+    # one row per response label, as in the per-row code: a label that occurs more than once stays at the
+    # position of its first occurrence, with the values of its last one
+    codes = facts.groupby(list(FR_TURN_COLUMNS[:3]), sort=False, dropna=False).ngroup().to_numpy()
+    last = len(codes) - 1 - np.unique(codes[::-1], return_index=True)[1]
+    turns = facts.iloc[last]
+    turn_results = _with_rate(turns[list(FR_TURN_COLUMNS[:5])], turns["DurationSec"].to_numpy(), turns["Freq"].to_numpy(), "DurationMin")
+    return cond_results, item_results, turn_results
 
-    return results
 
+# All result tables as RESULT_NAMES -> DataFrame from the tables of extract_all
+def result_frames(rl_results, sr_results, fact_results, fp_results):
+    facts = fact_results.to_frame()
+    cond_results, item_results, turn_results = fr_tables(facts)
+    frames = (rl_results.to_frame(), sr_results.to_frame(), cond_results, item_results, turn_results, fp_results.to_frame(), facts)
+    return dict(zip(RESULT_NAMES, frames))
 
-# Extract speaking rate (SR)
-def extract_sr(tg, participant_id, list_num):
-    results = []
-    turns_tier = tg.getTier("turns")
-    utterances_tier = tg.getTier("utterances")
-    condition_tier = tg.getTier("condition")
 
-    entries = turns_tier.entries
+# Library API: extract all result tables from in-memory tiers, without reading or writing TextGrid files
+# (the condition tier is added from the condition index if it is missing)
+def extract_frames(tiers, participant_id, condition_index=None, list_num=None):
+    tg = as_textgrid(tiers)
+    if list_num is None:
+        if condition_index is None:
+            raise ValueError("Either list_num or condition_index is needed")
+        list_num = get_list_num(participant_id, condition_index)
 
-    for i in range(0, len(entries)):
-        entry = entries[i]
-        if not entry[2].startswith("R"):
-            continue
+    if "condition" not in tg.tierNames:
+        if condition_index is None:
+            raise ValueError("No 'condition' tier and no condition index to build it from")
+        tg = add_condition_tier(tg, list_num, condition_index)
+
+    return result_frames(*extract_all(tg, participant_id, list_num))
 
-        # extract duration of the response in seconds
-        response_start, response_end = entry[0], entry[1]
-        duration = round(response_end - response_start, 3)
-
-        # count characters in utterances within the response interval
-        syllable_num = 0
-        for utt in utterances_tier.entries:
-            if utt[0] >= response_start and utt[1] <= response_end:
-                syllable_num += len(utt[2])
-
-        sr = round(syllable_num / duration, 3) if duration > 0 else 0
-        question_num = entry[2][1:]
-
-        # find the condition for this response based on start time
-        cond = None
-        for cond_entry in condition_tier.entries:
-            if abs(cond_entry[0] - entry[0]) < 1e-6:
-                cond = cond_entry[2]
-                break
-        
-        if cond is None:
-            raise ValueError(f"Condition not found for response {question_num} in participant {participant_id}, list {list_num}")
 
-        results.append({
-            "ParticipantID": participant_id,
-            "ListNum": list_num,
-            "QuestionNum": question_num,
-            "ResponseCond": cond,
-            "DurationSec": duration,
-            "SyllNum": syllable_num,
-            "SR": sr
-        })
+# Extract response latency (RL)
+def extract_rl(tg, participant_id, list_num):
+    return extract_all(tg, participant_id, list_num)[0].rows()
+
 
-    return results
+# Extract speaking rate (SR)
+def extract_sr(tg, participant_id, list_num):
+    return extract_all(tg, participant_id, list_num)[1].rows()
 
 
 # Extract FP rate (FR): per condition, per item, per turn
 def extract_fr(tg, participant_id, list_num):
-    turns_tier = tg.getTier("turns")
-    fps_tier = tg.getTier("FPs")
-    condition_tier = tg.getTier("condition")
+    facts = extract_all(tg, participant_id, list_num)[2].to_frame()
+    return tuple(table.to_dict("records") for table in fr_tables(facts))
 
-    # dictionaries to save different rates
-    per_cond = {} # one rate per condition and question type
-    per_item = {} # one rate per item
-    per_turn = {} # one rate per turn
 
-    entries = turns_tier.entries
+# Extract FP forms and positions
+def extract_fp_form_pos(tg, participant_id, list_num):
+    return extract_all(tg, participant_id, list_num)[3].rows()
 
-    for i in range(0, len(entries)):
-        entry = entries[i]
-        if not entry[2].startswith("R"):
-            continue
 
-        response_start, response_end = entry[0], entry[1]
-        response_label = entry[2]
+# Cache of per-file results, so a rerun only processes the TextGrid files that changed
+# (keyed by the file name and content, the condition sheet and the code of the extraction)
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
-        # save item and turn IDs
-        item_id = response_label[1:3]  # e.g., R010 -> 01
-        turn_id = response_label[1:]   # e.g., R010 -> 010
 
-        # find question type
-        question_type = None
-        if response_label.endswith("0"):
-            question_type = "Main"
-        else:
-            question_type = "FollowUp"
+def code_version():
+    h = hashlib.sha256()
+    for module_path in (__file__, textgrid_reader.__file__):
+        with open(module_path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
 
-        # find matching condition
-        cond = None
-        for cond_entry in condition_tier.entries:
-            if abs(cond_entry[0] - response_start) < 1e-6:
-                cond = cond_entry[2]
-                break
 
-        if cond is None:
-            raise ValueError(f"Condition not found for response {entry[2][1:]} in participant {participant_id}, list {list_num}")
-
-        # count FPs within the response interval
-        fp_count = 0
-        for fp in fps_tier.entries:
-            if fp[0] >= response_start and fp[1] <= response_end:
-                fp_count += 1
-
-        # calculate the duration of the response in seconds
-        duration = round(response_end - response_start, 3)
-
-        # update the dict: per condition and question type
-        key = (cond, question_type)
-        if key not in per_cond:
-            per_cond[key] = {"FP": 0, "Duration": 0}
-
-        per_cond[key]["FP"] += fp_count
-        per_cond[key]["Duration"] += duration
-
-        # update the dict: per item
-        key_item = (item_id, cond)
-        if key_item not in per_item:
-            per_item[key_item] = {"FP": 0, "Duration": 0}
-        per_item[key_item]["FP"] += fp_count
-        per_item[key_item]["Duration"] += duration
-
-        # update the dict: per turn
-        per_turn[turn_id] = {"FP": fp_count, "Duration": duration, "Cond": cond, "QuestionType": question_type}
-
-    # prepare results for output
-    cond_results = []
-    item_results = []
-    turn_results = []
-
-    # per condition results
-    for (cond, question_type), vals in per_cond.items():
-        total_duration_min = round(vals["Duration"] / 60, 3)
-        fr = round(vals["FP"] / total_duration_min, 3) if total_duration_min > 0 else 0
-        cond_results.append({
-            "ParticipantID": participant_id,
-            "ListNum": list_num,
-            "ResponseCond": cond,
-            "QuestionType": question_type,
-            "SumDurationMin": total_duration_min,
-            "Freq": vals["FP"],
-            "FR": fr
-        })
-
-    # per item results
-    for (item_id, cond), vals in per_item.items():
-        total_duration_min = round(vals["Duration"] / 60, 3)
-        fr = round(vals["FP"] / total_duration_min, 3) if total_duration_min > 0 else 0
-        item_results.append({
-            "ParticipantID": participant_id,
-            "ListNum": list_num,
-            "ItemID": item_id,
-            "ResponseCond": cond,
-            "SumDurationMin": total_duration_min,
-            "Freq": vals["FP"],
-            "FR": fr
-        })
-    
-    # per turn results
-    for turn_id, vals in per_turn.items():
-        duration_min = round(vals["Duration"] / 60, 3)
-        fr = round(vals["FP"] / duration_min, 3) if duration_min > 0 else 0
-        turn_results.append({
-            "ParticipantID": participant_id,
-            "ListNum": list_num,
-            "QuestionNum": turn_id,
-            "ResponseCond": vals["Cond"],
-            "QuestionType": vals["QuestionType"],
-            "DurationMin": duration_min,
-            "Freq": vals["FP"],
-            "FR": fr
-        })
+def cache_key(tg_path, condition_hash, version):
+    h = hashlib.sha256()
+    for part in (os.path.basename(tg_path), file_hash(tg_path), condition_hash, version):
+        h.update(part.encode("utf-8") + b"\0")
+    return h.hexdigest()
 
-    return cond_results, item_results, turn_results
 
+def load_cached(cache_dir, key):
+    cache_path = os.path.join(cache_dir, f"{key}.pkl")
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, "rb") as f:
+            return tuple(Table.from_columns(columns) for columns in pickle.load(f))
+    except Exception as e:
+        print(f"Ignoring unreadable cache entry {cache_path}: {e}")
+        return None
 
-# Extract FP forms and positions
-def extract_fp_form_pos(tg, participant_id, list_num):
-    turns_tier = tg.getTier("turns")
-    fps_tier = tg.getTier("FPs")
-    condition_tier = tg.getTier("condition")
 
-    results = []
-    entries = turns_tier.entries
+def save_cached(cache_dir, key, result):
+    # write to a temporary file first so an interrupted run never leaves a truncated entry
+    cache_path = os.path.join(cache_dir, f"{key}.pkl")
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        # plain column arrays, so the cache can be read no matter how this module was imported
+        pickle.dump([table.columns() for table in result], f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
 
-    for i in range(0, len(entries)):
-        entry = entries[i]
-        if not entry[2].startswith("R"):
-            continue
 
-        response_start, response_end = entry[0], entry[1]
-        question_num = entry[2][1:]
+# The hash of the extracted TextGrid written for a cache entry, so a cached result is only reused while the
+# _extracted file next to the input still is the one written for that entry
+def save_extracted_hash(cache_dir, key, tg_path):
+    with open(os.path.join(cache_dir, f"{key}.extracted"), "w", encoding="utf-8") as f:
+        f.write(file_hash(extracted_tg_path(tg_path)))
 
-        # find matching condition
-        cond = None
-        for cond_entry in condition_tier.entries:
-            if abs(cond_entry[0] - response_start) < 1e-6:
-                cond = cond_entry[2]
-                break
 
-        if cond is None:
-            raise ValueError(f"Condition not found for response {question_num} in participant {participant_id}, list {list_num}")
+def has_extracted(cache_dir, key, tg_path):
+    hash_path = os.path.join(cache_dir, f"{key}.extracted")
+    extracted_path = extracted_tg_path(tg_path)
+    if not (os.path.exists(hash_path) and os.path.exists(extracted_path)):
+        return False
+    with open(hash_path, encoding="utf-8") as f:
+        return f.read() == file_hash(extracted_path)
 
 
-        # find FPs within the response interval and save their forms and positions (turn INItial or INTernal)
-        for fp in fps_tier.entries:
-            if fp[0] >= response_start and fp[1] <= response_end:
-                form = fp[2]
-                position = "INI" if fp[0] == response_start else "INT"
+# Save one result table as CSV or as a typed, compressed columnar file (parquet and feather need pyarrow)
+OUTPUT_FORMATS = ("csv", "parquet", "feather")
+CATEGORICAL_COLUMNS = ("ParticipantID", "ListNum", "ResponseCond", "QuestionType", "Form", "Position")
 
-                results.append({
-                    "ParticipantID": participant_id,
-                    "ListNum": list_num,
-                    "QuestionNum": question_num,
-                    "ResponseCond": cond,
-                    "Form": form,
-                    "Position": position
-                })
+def save_table(table, output_folder, name, output_format="csv"):
+    df = table.to_frame() if isinstance(table, Table) else table
+    path = os.path.join(output_folder, f"{name}.{output_format}")
 
-    return results
+    if output_format == "csv":
+        df.to_csv(path, index=False)
+        return path
+
+    # on a new frame, the caller's frame is left as it is; the categories are strings, since parquet
+    # stores integer categories (ListNum) as plain integers
+    df = df.assign(**{col: df[col].astype(str).astype("category") for col in CATEGORICAL_COLUMNS if col in df.columns})
+
+    if output_format == "parquet":
+        df.to_parquet(path, index=False, compression="zstd")
+    elif output_format == "feather":
+        df.to_feather(path, compression="zstd")
+    else:
+        raise ValueError(f"Unknown output format: {output_format} (expected one of {', '.join(OUTPUT_FORMATS)})")
+    return path
 
 
 # MAIN PIPELINE
-def process_files(textgrid_folder, condition_excel, output_folder):
-    # load condition sheet
-    condition_df = pd.read_excel(condition_excel, header=None)
+def extracted_tg_path(tg_path):
+    participant_id = os.path.basename(tg_path).split("_")[0]
+    return os.path.join(os.path.dirname(tg_path), f"{participant_id}_extracted.TextGrid")
 
-    # find all TextGrid files in the input folder
-    textgrid_paths = glob.glob(os.path.join(textgrid_folder, "*.TextGrid"))
 
-    all_rl = []
-    all_sr = []
-    fr_cond = []
-    fr_item = []
-    fr_turn = []
-    all_fp_pos = []
+def save_extracted_tg(tg_path, tg):
+    with instrumentation.stage("save_extracted", file=tg_path):
+        tg.save(extracted_tg_path(tg_path), format="short_textgrid", includeBlankSpaces=True)
 
-    # run through each TextGrid file
-    for tg_path in textgrid_paths:
-        filename = os.path.basename(tg_path)
-        participant_id = filename.split("_")[0]  # e.g., 02 from "02_preprocessed.TextGrid"
-        list_num = get_list_num(participant_id, condition_df)
 
-        print(f"Processing: {filename}, {list_num}")
+# Process one TextGrid file (runs in a worker process when jobs > 1)
+# write(tg_path, tg) replaces the direct save of the extracted TextGrid, e.g. to save it in the background
+def process_file(tg_path, condition_index, save_extracted=True, write=None):
+    filename = os.path.basename(tg_path)
+    participant_id = filename.split("_")[0]  # e.g., 02 from "02_preprocessed.TextGrid"
+    list_num = get_list_num(participant_id, condition_index)
+
+    print(f"Processing: {filename}, {list_num}")
+
+    tg = read_textgrid(tg_path, include_empty=False)
+
+    tg = add_condition_tier(tg, list_num, condition_index)
+
+    # save the modified TextGrid with the new condition tier
+    if save_extracted:
+        (write or save_extracted_tg)(tg_path, tg)
+
+    return extract_all(tg, participant_id, list_num)
 
-        tg = textgrid.openTextgrid(tg_path, includeEmptyIntervals=False)
 
-        tg = add_condition_tier(tg, list_num, condition_df)
-        
-        # save the modified TextGrid with the new condition tier
-        new_tg_path = os.path.join(os.path.dirname(tg_path), f"{participant_id}_extracted.TextGrid")
-        tg.save(new_tg_path, format="short_textgrid", includeBlankSpaces=True)
+def process_files(textgrid_folder, condition_excel, output_folder, jobs=1, cache_dir=None, output_format="csv", check_labels=False, save_extracted=True):
+    # load condition sheet
+    with instrumentation.stage("load_conditions", file=condition_excel):
+        condition_index = load_condition_index(condition_excel)
+
+    # find all TextGrid files in the input folder (sorted, so the row order of the output is deterministic),
+    # except the _extracted files an earlier run saved next to them
+    textgrid_paths = sorted(
+        path for path in glob.glob(os.path.join(textgrid_folder, "*.TextGrid"))
+        if not path.endswith("_extracted.TextGrid")
+    )
+
+    # reuse the cached results of unchanged files
+    results = {}
+    cache_keys = {}
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        condition_hash = condition_index.sha256
+        version = code_version()
+        with instrumentation.stage("cache_lookup", items=len(textgrid_paths)):
+            for tg_path in textgrid_paths:
+                cache_keys[tg_path] = cache_key(tg_path, condition_hash, version)
+                cached = load_cached(cache_dir, cache_keys[tg_path])
+                if cached is not None and (not save_extracted or has_extracted(cache_dir, cache_keys[tg_path], tg_path)):
+                    results[tg_path] = cached
+        print(f"Cache: {len(results)} of {len(textgrid_paths)} files unchanged")
+
+    todo_paths = [tg_path for tg_path in textgrid_paths if tg_path not in results]
+
+    # run through each remaining TextGrid file, in parallel if requested
+    # (a failing file is reported and skipped, the others are still processed)
+    failed = []
+
+    # pre-flight: skip files whose turn labels are broken (duplicates, invalid or mismatched Q/R pairs)
+    if check_labels:
+        with instrumentation.stage("check_labels", items=len(todo_paths)):
+            checks = validate_files(todo_paths, jobs)
+        for check in checks:
+            if not check["valid"]:
+                problems = check["error"] or ", ".join(
+                    f"{len(check[key])} {key.replace('_', ' ')}"
+                    for key in ("duplicates", "invalid_pairs", "mismatched_pairs") if check[key]
+                )
+                print(f"Invalid labels in {os.path.basename(check['file'])}: {problems}")
+                failed.append(check["file"])
+        todo_paths = [tg_path for tg_path in todo_paths if tg_path not in failed]
+
+    def collect(tg_path, result):
+        results[tg_path] = result
+        if cache_dir is not None:
+            save_cached(cache_dir, cache_keys[tg_path], result)
+
+    def extracted_saved(tg_path):
+        if cache_dir is not None:
+            save_extracted_hash(cache_dir, cache_keys[tg_path], tg_path)
+
+    if jobs > 1:
+        # each worker saves its own extracted TextGrids, off the main process
+        # (with tracing on, the workers send their stage records back with the results)
+        task = instrumentation.traced(process_file) if instrumentation.is_enabled() else process_file
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(task, tg_path, condition_index, save_extracted): tg_path for tg_path in todo_paths}
+            for future in as_completed(futures):
+                tg_path = futures[future]
+                try:
+                    collect(tg_path, instrumentation.result(future.result()))
+                    if save_extracted:
+                        extracted_saved(tg_path)
+                except Exception as e:
+                    print(f"Error processing {os.path.basename(tg_path)}: {e}")
+                    failed.append(tg_path)
+    else:
+        # the extracted TextGrids are saved by a writer thread while the next files are extracted
+        writes = {}
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            def write(tg_path, tg):
+                # wait for the previous save first, so the TextGrids waiting to be written don't pile up in memory
+                if writes:
+                    wait([next(reversed(writes.values()))])
+                writes[tg_path] = writer.submit(save_extracted_tg, tg_path, tg)
+
+            for tg_path in todo_paths:
+                try:
+                    collect(tg_path, process_file(tg_path, condition_index, save_extracted, write))
+                except Exception as e:
+                    print(f"Error processing {os.path.basename(tg_path)}: {e}")
+                    failed.append(tg_path)
+
+        for tg_path, future in writes.items():
+            try:
+                future.result()
+                extracted_saved(tg_path)
+            except Exception as e:
+                print(f"Error saving {os.path.basename(extracted_tg_path(tg_path))}: {e}")
+                failed.append(tg_path)
+
+    all_rl = Table(RL_COLUMNS)
+    all_sr = Table(SR_COLUMNS)
+    all_facts = Table(FR_FACT_COLUMNS)
+    all_fp_pos = Table(FP_FORM_POS_COLUMNS)
+
+    # collect the results in file order
+    for tg_path in textgrid_paths:
+        if tg_path not in results:
+            continue
+        rl_res, sr_res, fact_res, fp_pos_res = results[tg_path]
+        all_rl.extend(rl_res)
+        all_sr.extend(sr_res)
+        all_facts.extend(fact_res)
+        all_fp_pos.extend(fp_pos_res)
 
-        all_rl.extend(extract_rl(tg, participant_id, list_num))
-        all_sr.extend(extract_sr(tg, participant_id, list_num))
-        fr_cond_res, fr_item_res, fr_turn_res = extract_fr(tg, participant_id, list_num)
-        fr_cond.extend(fr_cond_res)
-        fr_item.extend(fr_item_res)
-        fr_turn.extend(fr_turn_res)
-        all_fp_pos.extend(extract_fp_form_pos(tg, participant_id, list_num))
+    # the FR tables are derived from the facts of all files at once
+    facts = all_facts.to_frame()
+    with instrumentation.stage("fr_tables", items=len(facts)):
+        fr_cond, fr_item, fr_turn = fr_tables(facts)
 
     # create output folder if it doesn't exist
     os.makedirs(output_folder, exist_ok=True)
 
-    # save all results to CSV files
-    pd.DataFrame(all_rl).to_csv(os.path.join(output_folder, "ResponseLatency.csv"), index=False)
-    pd.DataFrame(all_sr).to_csv(os.path.join(output_folder, "SpeakingRate.csv"), index=False)
-    pd.DataFrame(fr_cond).to_csv(os.path.join(output_folder, "FP_Rate_Condition.csv"), index=False)
-    pd.DataFrame(fr_item).to_csv(os.path.join(output_folder, "FP_Rate_Item.csv"), index=False)
-    pd.DataFrame(fr_turn).to_csv(os.path.join(output_folder, "FP_Rate_Turn.csv"), index=False)
-    pd.DataFrame(all_fp_pos).to_csv(os.path.join(output_folder, "FP_Form_Position.csv"), index=False)
+    # save all results (CSV files by default)
+    for name, table in zip(RESULT_NAMES, (all_rl, all_sr, fr_cond, fr_item, fr_turn, all_fp_pos, facts)):
+        with instrumentation.stage("write_table", file=name, items=len(table)):
+            save_table(table, output_folder, name, output_format)
 
     print(f"RL: {len(all_rl)} rows")
     print(f"SR: {len(all_sr)} rows")
@@ -344,14 +712,35 @@ def process_files(textgrid_folder, condition_excel, output_folder):
     print(f"FP forms and positions: {len(all_fp_pos)} rows")
     print(f"Results saved to: {output_folder}")
 
+    if failed:
+        print(f"{len(failed)} file(s) failed: {', '.join(os.path.basename(path) for path in sorted(failed))}")
+    return failed
+
 # Example usage
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: python extract_features.py <TextGridFolder> <ConditionExcel> <OutputFolder>")
-        sys.exit(1)
-
-    textgrid_folder = sys.argv[1]
-    condition_excel = sys.argv[2]
-    output_folder = sys.argv[3]
-
-    process_files(textgrid_folder, condition_excel, output_folder)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Extract RL, SR, FR and FP features from annotated TextGrid files")
+    parser.add_argument("textgrid_folder", metavar="TextGridFolder")
+    parser.add_argument("condition_excel", metavar="ConditionExcel")
+    parser.add_argument("output_folder", metavar="OutputFolder")
+    parser.add_argument("--jobs", type=int, default=1, help="number of files processed in parallel (default: 1)")
+    parser.add_argument("--cache-dir", help="cache the results per file here and only process files that changed")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="csv", help="format of the output tables (default: csv)")
+    parser.add_argument("--check-labels", action="store_true", help="validate the turn labels first and skip files with broken labels")
+    parser.add_argument("--no-save-extracted", dest="save_extracted", action="store_false", help="don't write the _extracted.TextGrid files")
+    parser.add_argument("--trace", help="record the time and memory of each stage, save them to this JSON file and print a summary")
+    args = parser.parse_args()
+
+    if args.trace:
+        instrumentation.enable()
+
+    failed = process_files(
+        args.textgrid_folder, args.condition_excel, args.output_folder,
+        jobs=args.jobs, cache_dir=args.cache_dir, output_format=args.format, check_labels=args.check_labels,
+        save_extracted=args.save_extracted,
+    )
+
+    if args.trace:
+        instrumentation.save_trace(args.trace)
+        instrumentation.print_summary()
+        print(f"Trace saved to: {args.trace}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    import resource  # not available on Windows
+except ImportError:
+    resource = None
+
+# Per-stage timing and memory records for both pipelines (disabled unless enable() is called)
+#
+#     with instrumentation.stage("csv_to_txt", file=csv_path) as s:
+#         ...
+#         s.items = len(words)
+#
+# Each stage records its wall time, CPU time of the thread that ran it (not including subprocesses such as MFA),
+# the peak RSS of the process so far and an optional item count. save_trace() writes them in the Chrome trace
+# event format (chrome://tracing, https://ui.perfetto.dev) and print_summary() prints totals per stage.
+# When disabled, stage() returns a shared no-op object, so instrumented code costs one function call per stage.
+
+_enabled = False
+_records = []
+_lock = threading.Lock()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def is_enabled():
+    return _enabled
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss / (1 << 20) if sys.platform == "darwin" else maxrss / (1 << 10)
+
+
+class Stage:
+    def __init__(self, name, file=None, items=None):
+        self.name = name
+        self.file = file
+        self.items = items
+
+    def __enter__(self):
+        self.start = time.time()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record = {
+            "stage": self.name,
+            "file": None if self.file is None else os.path.basename(str(self.file)),
+            "start": self.start,
+            "wall": time.perf_counter() - self.wall_start,
+            "cpu": time.thread_time() - self.cpu_start,
+            "peak_rss_mb": peak_rss_mb(),
+            "items": self.items,
+            "pid": os.getpid(),
+            "thread": threading.get_ident(),
+            "error": None if exc_type is None else exc_type.__name__,
+        }
+        with _lock:
+            _records.append(record)
+        return False
+
+
+class _NullStage:
+    items = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name, file=None, items=None):
+    # file: the file (or participant) the stage worked on; items: e.g. number of rows or intervals produced
+    if not _enabled:
+        return _NULL_STAGE
+    return Stage(name, file, items)
+
+
+def records():
+    with _lock:
+        return list(_records)
+
+
+def drain():
+    with _lock:
+        drained = list(_records)
+        _records.clear()
+    return drained
+
+
+def merge(new_records):
+    with _lock:
+        _records.extend(new_records)
+
+
+# Worker processes keep their own records: traced(func) runs func with tracing on in the worker
+# and sends the records back with the result, and result() merges them into this process's records
+class TracedResult:
+    def __init__(self, value, records):
+        self.value = value
+        self.records = records
+
+
+class _Traced:
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, *args, **kwargs):
+        enable()
+        drain()  # a forked worker starts with a copy of the parent's records
+        return TracedResult(self.func(*args, **kwargs), drain())
+
+
+def traced(func):
+    return _Traced(func)
+
+
+def result(value):
+    if isinstance(value, TracedResult):
+        merge(value.records)
+        return value.value
+    return value
+
+
+# Run func(*args) for each tuple in arg_tuples, in parallel processes if jobs > 1 (with the workers' records merged
+# back when tracing is on); a failing call is reported and skipped, the others still run
+# (returns the argument tuples that failed with their errors; the results of func are not kept)
+def run_batch(func, arg_tuples, jobs=1, action="processing"):
+    failed = []
+    if jobs > 1:
+        task = traced(func) if _enabled else func
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(task, *args): args for args in arg_tuples}
+            for future in as_completed(futures):
+                try:
+                    result(future.result())
+                except Exception as e:
+                    print(f"Error {action} {futures[future][0]}: {e}")
+                    failed.append((futures[future], e))
+    else:
+        for args in arg_tuples:
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"Error {action} {args[0]}: {e}")
+                failed.append((args, e))
+    return failed
+
+
+def summary():
+    by_stage = {}
+    for record in records():
+        totals = by_stage.setdefault(record["stage"], {
+            "stage": record["stage"], "count": 0, "wall": 0.0, "max_wall": 0.0, "cpu": 0.0, "items": 0,
+            "peak_rss_mb": None, "errors": 0,
+        })
+        totals["count"] += 1
+        totals["wall"] += record["wall"]
+        totals["max_wall"] = max(totals["max_wall"], record["wall"])
+        totals["cpu"] += record["cpu"]
+        totals["items"] += record["items"] or 0
+        if record["peak_rss_mb"] is not None:
+            totals["peak_rss_mb"] = max(totals["peak_rss_mb"] or 0, record["peak_rss_mb"])
+        totals["errors"] += record["error"] is not None
+    return list(by_stage.values())
+
+
+def print_summary():
+    rows = summary()
+    if not rows:
+        return
+    print(f"\n{'Stage':<22}{'Count':>7}{'Wall s':>10}{'Max s':>9}{'CPU s':>9}{'Items':>10}{'Peak RSS MB':>13}{'Errors':>8}")
+    for row in rows:
+        rss = "" if row["peak_rss_mb"] is None else f"{row['peak_rss_mb']:.1f}"
+        print(
+            f"{row['stage']:<22}{row['count']:>7}{row['wall']:>10.3f}{row['max_wall']:>9.3f}{row['cpu']:>9.3f}"
+            f"{row['items']:>10}{rss:>13}{row['errors']:>8}"
+        )
+
+
+def save_trace(path):
+    # complete ("X") events with microsecond timestamps; the other measures are kept in args
+    events = [
+        {
+            "name": record["stage"],
+            "ph": "X",
+            "ts": round(record["start"] * 1e6),
+            "dur": round(record["wall"] * 1e6),
+            "pid": record["pid"],
+            "tid": record["thread"],
+            "args": {key: record[key] for key in ("file", "cpu", "peak_rss_mb", "items", "error")},
+        }
+        for record in records()
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "summary": summary()}, f, indent=1)
@@ -0,0 +1,173 @@
+import os
+import sys
+import glob
+import argparse
+import numpy as np
+from praatio import textgrid
+import instrumentation
+from textgrid_reader import POINT_TIER, read_textgrid
+from checkLabel import EXPECTED_PAIRS
+from acoustic_features import open_wav, to_mono
+
+# Pre-segmentation: proposes the Q/R turns (and untranscribed FPs) of a _preprocessed.TextGrid from the
+# speech in the recording, so annotators correct boundaries instead of placing every one of them by hand.
+#   1. frame energies of the .wav, streamed from the memory-mapped file chunk by chunk (bounded memory)
+#   2. speech regions: frames louder than the noise floor + margin, short gaps filled and short blips dropped
+#   3. turns: speech regions and utterances merged where they are less than turn_gap apart,
+#      labelled Q010, R010, Q011, R011, ... in order (the speakers alternate)
+#   4. FPs: short speech regions inside a response that no utterance covers (labelled "FP?" to be checked)
+
+# labels in the order the turns are expected: Q010, R010, Q011, R011, ...
+TURN_LABELS = [label for pair in EXPECTED_PAIRS for label in pair]
+FP_LABEL = "FP?"
+
+
+# STEP 1: energy (dB re full scale) of consecutive frames, chunk_sec of audio at a time
+def frame_energies_db(wav, frame_sec=0.02, chunk_sec=60):
+    frame_len = max(int(frame_sec * wav.sample_rate), 1)
+    num_frames = len(wav.samples) // frame_len
+    chunk_frames = max(int(chunk_sec / frame_sec), 1)
+
+    energies = np.empty(num_frames)
+    for first in range(0, num_frames, chunk_frames):
+        last = min(first + chunk_frames, num_frames)
+        chunk = wav.samples[first * frame_len:last * frame_len]
+        x = to_mono(wav, chunk)
+        frames = x.reshape(last - first, frame_len)
+        energies[first:last] = np.einsum("ij,ij->i", frames, frames) / frame_len
+    return 10 * np.log10(energies + 1e-12)
+
+
+# [start, end) index ranges of the runs of True in a boolean array
+def true_runs(mask):
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+# merge sorted or unsorted intervals that overlap or are at most max_gap apart
+def merge_intervals(starts, ends, max_gap=0.0):
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    if len(starts) == 0:
+        return starts, ends
+    order = np.argsort(starts, kind="stable")
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+    is_new = np.concatenate(([True], starts[1:] > reach[:-1] + max_gap))
+    first = np.flatnonzero(is_new)
+    last = np.concatenate((first[1:], [len(starts)])) - 1
+    return starts[first], reach[last]
+
+
+# STEP 2: speech regions in seconds
+def speech_regions(energies_db, frame_sec=0.02, margin_db=12.0, min_speech=0.15, min_silence=0.3):
+    if len(energies_db) == 0:
+        return np.empty(0), np.empty(0)
+    noise_floor = np.percentile(energies_db, 10)
+    starts, ends = true_runs(energies_db > noise_floor + margin_db)
+
+    # fill short pauses, then drop what is still too short to be speech
+    starts, ends = merge_intervals(starts * frame_sec, ends * frame_sec, max_gap=min_silence)
+    keep = (ends - starts) >= min_speech
+    return starts[keep], ends[keep]
+
+
+# STEP 3 & 4: turns and FP candidates from the speech regions and the utterances
+def propose_turns(speech_starts, speech_ends, utterance_entries, turn_gap=0.5, max_fp_duration=1.0):
+    utt_starts = np.array([entry[0] for entry in utterance_entries], dtype=np.float64)
+    utt_ends = np.array([entry[1] for entry in utterance_entries], dtype=np.float64)
+
+    turn_starts, turn_ends = merge_intervals(
+        np.concatenate((speech_starts, utt_starts)), np.concatenate((speech_ends, utt_ends)), max_gap=turn_gap,
+    )
+    if len(turn_starts) > len(TURN_LABELS):
+        print(f"{len(turn_starts)} turns found, only the first {len(TURN_LABELS)} are labelled")
+        turn_starts, turn_ends = turn_starts[:len(TURN_LABELS)], turn_ends[:len(TURN_LABELS)]
+    turns = list(zip(turn_starts.tolist(), turn_ends.tolist(), TURN_LABELS[:len(turn_starts)]))
+
+    # FP candidates: short speech regions that overlap no utterance and lie within a response
+    # (a region overlaps an utterance if the utterances starting before its end reach past its start)
+    covered = np.zeros(len(speech_starts), dtype=bool)
+    if len(utt_starts):
+        order = np.argsort(utt_starts, kind="stable")
+        utt_starts, utt_reach = utt_starts[order], np.maximum.accumulate(utt_ends[order])
+        before_end = np.searchsorted(utt_starts, speech_ends, side="left")
+        covered = (before_end > 0) & (utt_reach[np.maximum(before_end - 1, 0)] > speech_starts)
+    short = (speech_ends - speech_starts) <= max_fp_duration
+
+    turn_idx = np.searchsorted(turn_starts, speech_starts, side="right") - 1
+    in_turn = (turn_idx >= 0) & (speech_ends <= turn_ends[np.maximum(turn_idx, 0)]) if len(turn_starts) else covered & False
+    in_response = in_turn & (turn_idx % 2 == 1)  # R labels are at odd positions
+    is_fp = ~covered & short & in_response
+    fps = [(start, end, FP_LABEL) for start, end in zip(speech_starts[is_fp].tolist(), speech_ends[is_fp].tolist())]
+    return turns, fps
+
+
+# pre-segment one _preprocessed.TextGrid (tiers that annotators already filled in are kept unless overwrite=True)
+def presegment(textgrid_path, wav_path, output_path=None, overwrite=False, turn_gap=0.5, margin_db=12.0):
+    tg = read_textgrid(textgrid_path, include_empty=False)
+    for tier_name in ["turns", "utterances"]:
+        if tier_name not in tg.tierNames:
+            raise ValueError(f"No '{tier_name}' tier found in {textgrid_path}")
+
+    wav = open_wav(wav_path)
+    with instrumentation.stage("vad", file=wav_path) as s:
+        energies_db = frame_energies_db(wav)
+        speech_starts, speech_ends = speech_regions(energies_db, margin_db=margin_db)
+        s.items = len(speech_starts)
+
+    with instrumentation.stage("propose_turns", file=textgrid_path) as s:
+        turns, fps = propose_turns(speech_starts, speech_ends, tg.getTier("utterances").entries, turn_gap=turn_gap)
+        s.items = len(turns)
+
+    # the tiers keep their order (turns, utterances, FPs, ...)
+    max_t = max(tg.maxTimestamp, turns[-1][1] if turns else 0)
+    proposed = {"turns": turns, "FPs": fps}
+    updated = []
+    new_tg = textgrid.Textgrid(tg.minTimestamp, max_t)
+    for name in tg.tierNames + tuple(name for name in proposed if name not in tg.tierNames):
+        tier = tg.getTier(name) if name in tg.tierNames else None
+        entries = tier.entries if tier is not None else []
+        if name in proposed and (overwrite or not entries):
+            new_tg.addTier(textgrid.IntervalTier(name, proposed[name], 0, max_t))
+            updated.append(name)
+        elif tier.tierType == POINT_TIER:
+            new_tg.addTier(textgrid.PointTier(name, entries, 0, max_t))
+        else:
+            new_tg.addTier(textgrid.IntervalTier(name, entries, 0, max_t))
+
+    output_path = output_path or textgrid_path
+    # a file without empty tiers to fill in is left as it is
+    if updated or output_path != textgrid_path:
+        new_tg.save(output_path, format="short_textgrid", includeBlankSpaces=True)
+    print(f"Pre-segmented {os.path.basename(output_path)}: {len(turns)} turns, {len(fps)} FPs proposed"
+          f" ({', '.join(updated) if updated else 'no empty tiers, nothing'} written)")
+    return len(turns), len(fps)
+
+
+# run presegment on many (textgrid_path, wav_path) pairs, in parallel processes if jobs > 1
+# (returns the pairs that failed with their errors)
+def presegment_batch(path_pairs, jobs=1, overwrite=False, turn_gap=0.5, margin_db=12.0):
+    arg_tuples = [(tg_path, wav_path, None, overwrite, turn_gap, margin_db) for tg_path, wav_path in path_pairs]
+    failed = instrumentation.run_batch(presegment, arg_tuples, jobs, action="pre-segmenting")
+    return [(args[:2], e) for args, e in failed]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Propose Q/R turns and FPs in _preprocessed.TextGrid files from the speech in the .wav files")
+    parser.add_argument("textgrid_folder", metavar="TextGridFolder")
+    parser.add_argument("wav_folder", metavar="WavFolder")
+    parser.add_argument("--jobs", type=int, default=1, help="number of files processed in parallel (default: 1)")
+    parser.add_argument("--overwrite", action="store_true", help="replace turns and FPs tiers that already have intervals")
+    parser.add_argument("--turn-gap", type=float, default=0.5, help="shortest pause between two turns in seconds (default: 0.5)")
+    parser.add_argument("--margin-db", type=float, default=12.0, help="speech threshold above the noise floor in dB (default: 12)")
+    args = parser.parse_args()
+
+    tg_paths = sorted(glob.glob(os.path.join(args.textgrid_folder, "*_preprocessed.TextGrid")))
+    path_pairs = [
+        (tg_path, os.path.join(args.wav_folder, f"{os.path.basename(tg_path).split('_')[0]}.wav"))
+        for tg_path in tg_paths
+    ]
+    failed = presegment_batch(path_pairs, args.jobs, args.overwrite, args.turn_gap, args.margin_db)
+    print(f"Pre-segmented {len(path_pairs) - len(failed)} of {len(path_pairs)} files.")
+    sys.exit(1 if failed else 0)
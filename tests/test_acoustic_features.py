@@ -0,0 +1,30 @@
+import wave
+import numpy as np
+import pytest
+from acoustic_features import interval_samples, open_wav
+
+
+def write_wav(path, samples, sample_width, channels):
+    data = samples.astype("<i4").view(np.uint8).reshape(-1, 4)[:, :sample_width].tobytes()
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(sample_width)
+        f.setframerate(1000)
+        f.writeframes(data)
+
+
+@pytest.mark.parametrize("sample_width", [2, 3, 4])
+@pytest.mark.parametrize("channels", [1, 2])
+def test_pcm_samples(tmp_path, sample_width, channels):
+    full_scale = 2 ** (8 * sample_width - 1)
+    rnd = np.random.default_rng(sample_width)
+    samples = rnd.integers(-full_scale, full_scale, size=(2000, channels))
+    samples[:4, 0] = [-full_scale, full_scale - 1, -1, 0]
+    path = tmp_path / "01.wav"
+    write_wav(path, samples, sample_width, channels)
+
+    wav = open_wav(str(path))
+    assert wav.sample_rate == 1000 and len(wav.samples) == 2000
+    expected = samples.mean(axis=1) / full_scale
+    np.testing.assert_allclose(interval_samples(wav, 0, 2), expected)
+    np.testing.assert_allclose(interval_samples(wav, 0.5, 0.75), expected[500:750])
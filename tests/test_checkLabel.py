@@ -0,0 +1,61 @@
+from praatio import textgrid
+from checkLabel import EXPECTED_PAIRS, check_turns, validate_folder, validate_turns
+
+
+def complete_turns():
+    entries = []
+    for k, (q_label, r_label) in enumerate(EXPECTED_PAIRS):
+        entries.append((2 * k, 2 * k + 0.5, q_label))
+        entries.append((2 * k + 1, 2 * k + 1.5, r_label))
+    return entries
+
+
+def save_turns(path, entries):
+    tg = textgrid.Textgrid()
+    tg.addTier(textgrid.IntervalTier("turns", entries, 0, max((entry[1] for entry in entries), default=1)))
+    tg.save(str(path), format="short_textgrid", includeBlankSpaces=True)
+
+
+def test_valid_turns():
+    result = validate_turns(complete_turns())
+    assert result["valid"]
+    assert not (result["duplicates"] or result["invalid_pairs"] or result["mismatched_pairs"] or result["missing_pairs"])
+
+
+def test_broken_pair_before_valid_pairs_is_reported(tmp_path, capsys):
+    # the old check reset its flag for every pair, so a broken pair followed by a valid one went unnoticed
+    entries = complete_turns()
+    entries[0], entries[1] = (entries[0][0], entries[0][1], "R010"), (entries[1][0], entries[1][1], "Q010")
+    result = validate_turns(entries)
+    assert not result["valid"]
+    assert [(pair["q_label"], pair["r_label"]) for pair in result["invalid_pairs"]] == [("R010", "Q010")]
+
+    path = tmp_path / "01_preprocessed.TextGrid"
+    save_turns(path, entries)
+    check_turns(str(path))
+    output = capsys.readouterr().out
+    assert "Invalid labels at positions 0.0 and 1.0: R010, Q010" in output
+    assert "All existing Q/R pairs are valid." not in output
+
+
+def test_mismatched_and_duplicate_labels():
+    entries = complete_turns()
+    entries[3] = (entries[3][0], entries[3][1], "R012")
+    result = validate_turns(entries)
+    assert not result["valid"]
+    assert [(pair["q_label"], pair["r_label"]) for pair in result["mismatched_pairs"]] == [("Q011", "R012")]
+    assert result["duplicates"] == {"R012": 2}
+    assert [pair["r_label"] for pair in result["missing_pairs"]] == ["R011"]
+
+
+def test_short_tiers():
+    # fewer than two labels used to crash
+    assert validate_turns([])["valid"]
+    assert validate_turns([(0, 1, "Q010")])["valid"]
+
+
+def test_folder_skips_extracted_copies(tmp_path):
+    save_turns(tmp_path / "01_preprocessed.TextGrid", complete_turns())
+    save_turns(tmp_path / "01_extracted.TextGrid", complete_turns())
+    results = validate_folder(str(tmp_path))
+    assert [result["file"] for result in results] == [str(tmp_path / "01_preprocessed.TextGrid")]
@@ -0,0 +1,267 @@
+import random
+import pandas as pd
+import pytest
+from praatio import textgrid
+import extracting_features as ef
+
+
+# Reference implementation: the per-row extractors extract_all replaced (one scan of the tiers per response)
+def reference_add_condition_tier(tg, list_num, condition_df):
+    new_entries = []
+    for entry in tg.getTier("turns").entries:
+        label = entry[2]
+        if label.startswith("R"):
+            rownum = int(label[1:3]) + 1
+            new_entries.append((entry[0], entry[1], condition_df[list_num].iloc[rownum]))
+    tg.addTier(textgrid.IntervalTier(name="condition", entries=new_entries, minT=0, maxT=tg.maxTimestamp))
+    return tg
+
+
+def reference_condition(tg, start, question_num, participant_id, list_num):
+    for cond_entry in tg.getTier("condition").entries:
+        if abs(cond_entry[0] - start) < 1e-6:
+            return cond_entry[2]
+    raise ValueError(f"Condition not found for response {question_num} in participant {participant_id}, list {list_num}")
+
+
+def reference_rl(tg, participant_id, list_num):
+    results = []
+    entries = tg.getTier("turns").entries
+    for i in range(0, len(entries) - 1, 2):
+        q_entry = entries[i]
+        r_entry = entries[i + 1]
+        if not (q_entry[2].startswith("Q") and r_entry[2].startswith("R")):
+            continue
+        rl = round((r_entry[0] - q_entry[1]) * 1000, 3)
+        question_num = q_entry[2][1:]
+        cond = reference_condition(tg, r_entry[0], question_num, participant_id, list_num)
+        results.append({"ParticipantID": participant_id, "ListNum": list_num, "QuestionNum": question_num, "ResponseCond": cond, "RLMilSec": rl})
+    return results
+
+
+def reference_sr(tg, participant_id, list_num):
+    results = []
+    for entry in tg.getTier("turns").entries:
+        if not entry[2].startswith("R"):
+            continue
+        response_start, response_end = entry[0], entry[1]
+        duration = round(response_end - response_start, 3)
+        syllable_num = 0
+        for utt in tg.getTier("utterances").entries:
+            if utt[0] >= response_start and utt[1] <= response_end:
+                syllable_num += len(utt[2])
+        sr = round(syllable_num / duration, 3) if duration > 0 else 0
+        question_num = entry[2][1:]
+        cond = reference_condition(tg, entry[0], question_num, participant_id, list_num)
+        results.append({
+            "ParticipantID": participant_id, "ListNum": list_num, "QuestionNum": question_num, "ResponseCond": cond,
+            "DurationSec": duration, "SyllNum": syllable_num, "SR": sr,
+        })
+    return results
+
+
+def reference_fr(tg, participant_id, list_num):
+    per_cond, per_item, per_turn = {}, {}, {}
+    for entry in tg.getTier("turns").entries:
+        if not entry[2].startswith("R"):
+            continue
+        response_start, response_end = entry[0], entry[1]
+        response_label = entry[2]
+        item_id = response_label[1:3]
+        turn_id = response_label[1:]
+        question_type = "Main" if response_label.endswith("0") else "FollowUp"
+        cond = reference_condition(tg, response_start, turn_id, participant_id, list_num)
+        fp_count = 0
+        for fp in tg.getTier("FPs").entries:
+            if fp[0] >= response_start and fp[1] <= response_end:
+                fp_count += 1
+        duration = round(response_end - response_start, 3)
+
+        for per, key in ((per_cond, (cond, question_type)), (per_item, (item_id, cond))):
+            vals = per.setdefault(key, {"FP": 0, "Duration": 0})
+            vals["FP"] += fp_count
+            vals["Duration"] += duration
+        per_turn[turn_id] = {"FP": fp_count, "Duration": duration, "Cond": cond, "QuestionType": question_type}
+
+    def rate(fp, duration):
+        duration_min = round(duration / 60, 3)
+        return duration_min, round(fp / duration_min, 3) if duration_min > 0 else 0
+
+    cond_results, item_results, turn_results = [], [], []
+    for (cond, question_type), vals in per_cond.items():
+        duration_min, fr = rate(vals["FP"], vals["Duration"])
+        cond_results.append({
+            "ParticipantID": participant_id, "ListNum": list_num, "ResponseCond": cond, "QuestionType": question_type,
+            "SumDurationMin": duration_min, "Freq": vals["FP"], "FR": fr,
+        })
+    for (item_id, cond), vals in per_item.items():
+        duration_min, fr = rate(vals["FP"], vals["Duration"])
+        item_results.append({
+            "ParticipantID": participant_id, "ListNum": list_num, "ItemID": item_id, "ResponseCond": cond,
+            "SumDurationMin": duration_min, "Freq": vals["FP"], "FR": fr,
+        })
+    for turn_id, vals in per_turn.items():
+        duration_min, fr = rate(vals["FP"], vals["Duration"])
+        turn_results.append({
+            "ParticipantID": participant_id, "ListNum": list_num, "QuestionNum": turn_id, "ResponseCond": vals["Cond"],
+            "QuestionType": vals["QuestionType"], "DurationMin": duration_min, "Freq": vals["FP"], "FR": fr,
+        })
+    return cond_results, item_results, turn_results
+
+
+def reference_fp_form_pos(tg, participant_id, list_num):
+    results = []
+    for entry in tg.getTier("turns").entries:
+        if not entry[2].startswith("R"):
+            continue
+        response_start, response_end = entry[0], entry[1]
+        question_num = entry[2][1:]
+        cond = reference_condition(tg, response_start, question_num, participant_id, list_num)
+        for fp in tg.getTier("FPs").entries:
+            if fp[0] >= response_start and fp[1] <= response_end:
+                position = "INI" if fp[0] == response_start else "INT"
+                results.append({
+                    "ParticipantID": participant_id, "ListNum": list_num, "QuestionNum": question_num,
+                    "ResponseCond": cond, "Form": fp[2], "Position": position,
+                })
+    return results
+
+
+# condition sheet with two lists: row 0 list name, row 1 participant ID, row n + 1 condition of item n
+CONDITION_DF = pd.DataFrame(
+    [["List1", "List2"], ["07", "08"]] + [["T" if item % 2 else "D", "D" if item % 3 else "T"] for item in range(1, 51)]
+)
+
+
+def make_textgrid(turns, utterances, fps):
+    max_t = max(entry[1] for entry in turns + utterances + fps) + 1
+    tg = textgrid.Textgrid()
+    for name, entries in (("turns", turns), ("utterances", utterances), ("FPs", fps)):
+        tg.addTier(textgrid.IntervalTier(name, entries, 0, max_t))
+    return tg
+
+
+def random_tiers(seed, num_items=20):
+    # Q/R pairs with some Qs or Rs dropped, so later turns are out of their (even, odd) pair positions
+    rnd = random.Random(seed)
+    turns, utterances, fps = [], [], []
+    t = 0.5
+    for item in range(1, num_items + 1):
+        for follow_up in range(rnd.randint(1, 3)):
+            label = f"{item:02d}{follow_up}"
+            q_end = t + rnd.uniform(0.5, 2)
+            if rnd.random() > 0.1:
+                turns.append((t, q_end, f"Q{label}"))
+            r_start = q_end + rnd.uniform(0.05, 1)
+            r_end = r_start + rnd.uniform(0.5, 6)
+            if rnd.random() > 0.1:
+                turns.append((r_start, r_end, f"R{label}"))
+                x = r_start
+                while x < r_end - 0.3:
+                    y = min(r_end, x + rnd.uniform(0.2, 1.5))
+                    utterances.append((x, y, "가" * rnd.randint(1, 8)))
+                    x = y + rnd.uniform(0.05, 0.4)
+                # FPs at the start of the response, inside it and across its end
+                if rnd.random() < 0.3:
+                    fps.append((r_start, r_start + 0.1, rnd.choice("음어")))
+                for _ in range(rnd.randint(0, 3)):
+                    fp_start = rnd.uniform(r_start + 0.15, r_end + 0.2)
+                    if not fps or fp_start > fps[-1][1]:
+                        fps.append((fp_start, fp_start + 0.1, rnd.choice("음어그")))
+            t = r_end + rnd.uniform(0.3, 1)
+    return turns, utterances, fps
+
+
+def edge_case_tiers():
+    turns = [
+        (0.5, 1, "R010"),   # R without a preceding Q
+        (1.2, 2, "Q011"),   # this pair is at positions (odd, even), so it has no RL
+        (2.5, 4, "R011"),
+        (4, 5, "R012"),     # R right after R, sharing its boundary
+        (5.5, 6, "Q020"),
+        (6.2, 8, "R020"),
+        (8.5, 9, "Q030"),   # Q without a response
+        (9.5, 10.5, "R011"),  # the same response label again
+    ]
+    utterances = [(0.4, 0.7, "ab"), (0.7, 1.0, "cde"), (2.5, 3, "xy"), (3.9, 4.2, "zz"), (6.2, 8, "long")]
+    fps = [
+        (0.5, 0.6, "음"),   # turn-initial
+        (3.95, 4.0, "어"),  # ends on the boundary of R011
+        (4.0, 4.5, "그"),   # starts on the boundary of R012
+        (6.2, 6.3, "음"),
+        (7.9, 8.1, "어"),   # crosses the end of R020
+        (9.6, 9.7, "음"),
+    ]
+    return turns, utterances, fps
+
+
+def assert_equivalent(tiers, participant_id):
+    list_num = 0 if participant_id == "07" else 1
+    reference_tg = reference_add_condition_tier(make_textgrid(*tiers), list_num, CONDITION_DF)
+    tg = ef.add_condition_tier(make_textgrid(*tiers), list_num, ef.ConditionIndex.from_dataframe(CONDITION_DF))
+
+    rl_results, sr_results, fact_results, fp_results = ef.extract_all(tg, participant_id, list_num)
+    fr_results = tuple(table.to_dict("records") for table in ef.fr_tables(fact_results.to_frame()))
+
+    assert rl_results.rows() == reference_rl(reference_tg, participant_id, list_num)
+    assert sr_results.rows() == reference_sr(reference_tg, participant_id, list_num)
+    assert fr_results == reference_fr(reference_tg, participant_id, list_num)
+    assert fp_results.rows() == reference_fp_form_pos(reference_tg, participant_id, list_num)
+
+
+def test_edge_cases():
+    assert_equivalent(edge_case_tiers(), "07")
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_random_textgrids(seed):
+    assert_equivalent(random_tiers(seed), "07" if seed % 2 else "08")
+
+
+def test_unsorted_entries():
+    # raw entry lists are sorted before the array lookups, as the TextGrid files are
+    tiers = {
+        "turns": [(5, 9, "R011"), (4, 4.5, "Q011"), (0, 1, "Q010"), (1.5, 3, "R010")],
+        "utterances": [(6, 7, "abc"), (2, 2.5, "de")],
+        "FPs": [(6, 6.2, "음"), (1.5, 1.7, "어")],
+    }
+    condition_index = ef.ConditionIndex.from_dataframe(CONDITION_DF)
+    frames = ef.extract_frames(tiers, "07", condition_index)
+    expected = ef.extract_frames(make_textgrid(*tiers.values()), "07", condition_index)
+    for name in ef.RESULT_NAMES:
+        pd.testing.assert_frame_equal(frames[name], expected[name])
+    assert frames["SpeakingRate"]["SyllNum"].tolist() == [2, 3]
+    assert frames["FP_Form_Position"][["QuestionNum", "Form", "Position"]].values.tolist() == [["010", "어", "INI"], ["011", "음", "INT"]]
+
+    with pytest.raises(textgrid.errors.TextgridStateError):
+        ef.extract_frames({**tiers, "FPs": [(6, 6.2, "음"), (6.1, 6.3, "어")]}, "07", condition_index)
+
+
+def test_cache_keeps_extracted_textgrids_current(tmp_path):
+    condition_excel = tmp_path / "conditions.xlsx"
+    CONDITION_DF.to_excel(condition_excel, header=False, index=False)
+    in_dir, cache_dir = tmp_path / "in", tmp_path / "cache"
+    in_dir.mkdir()
+    turns, utterances, fps = edge_case_tiers()
+    for participant_id in ("07", "08"):
+        make_textgrid(turns, utterances, fps).save(str(in_dir / f"{participant_id}_preprocessed.TextGrid"), format="short_textgrid", includeBlankSpaces=True)
+
+    def run(save_extracted=True):
+        return ef.process_files(str(in_dir), str(condition_excel), str(tmp_path / "out"), cache_dir=str(cache_dir), save_extracted=save_extracted)
+
+    def extracted_fps():
+        tg = textgrid.openTextgrid(str(in_dir / "07_extracted.TextGrid"), includeEmptyIntervals=False)
+        return [tuple(entry) for entry in tg.getTier("FPs").entries]
+
+    assert run() == []
+    make_textgrid(turns, utterances, fps[:2]).save(str(in_dir / "07_preprocessed.TextGrid"), format="short_textgrid", includeBlankSpaces=True)
+    assert run(save_extracted=False) == []
+    # the cached result of the changed file was stored without an extracted TextGrid, which is still the old one
+    assert len(extracted_fps()) == len(fps)
+    assert run() == []
+    assert extracted_fps() == [tuple(entry) for entry in fps[:2]]
+
+    # an extracted TextGrid changed or removed by hand is written again
+    (in_dir / "08_extracted.TextGrid").unlink()
+    assert run() == []
+    assert (in_dir / "08_extracted.TextGrid").exists()
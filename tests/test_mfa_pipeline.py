@@ -0,0 +1,174 @@
+import os
+import sys
+import json
+import subprocess
+import pytest
+from praatio import textgrid
+import MFA_pipeline
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Stand-in for the mfa command: logs its arguments and writes a words/phones TextGrid for every speaker
+# folder of the corpus; a corpus with a speaker whose ID contains "bad" fails with exit code 3
+STUB_MFA = """#!{python}
+import os, sys, json
+from praatio import textgrid
+args = sys.argv[1:]
+positional = [a for i, a in enumerate(args) if not a.startswith("-") and args[i - 1] not in ("--num_jobs", "--temporary_directory")]
+_, corpus, dictionary, model, output = positional
+with open(os.environ["STUB_MFA_LOG"], "a") as f:
+    f.write(json.dumps({{"args": args, "speakers": sorted(os.listdir(corpus))}}) + "\\n")
+for speaker in sorted(os.listdir(corpus)):
+    if "bad" in speaker:
+        sys.exit(3)
+    file_id = speaker[1:]
+    words = [(0.1, 0.4, "안녕"), (0.4, 0.8, "하세요"), (1.5, 1.9, "네")]
+    tg = textgrid.Textgrid()
+    tg.addTier(textgrid.IntervalTier("words", words, 0, 2))
+    tg.addTier(textgrid.IntervalTier("phones", [(0.1, 0.4, "a")], 0, 2))
+    os.makedirs(os.path.join(output, speaker), exist_ok=True)
+    tg.save(os.path.join(output, speaker, file_id + ".TextGrid"), format="long_textgrid", includeBlankSpaces=True)
+"""
+
+
+@pytest.fixture
+def stub_mfa(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    stub = bin_dir / "mfa"
+    stub.write_text(STUB_MFA.format(python=sys.executable), encoding="utf-8")
+    stub.chmod(0o755)
+    log = tmp_path / "mfa_calls.log"
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("STUB_MFA_LOG", str(log))
+
+    def calls():
+        if not log.exists():
+            return []
+        return [json.loads(line) for line in log.read_text(encoding="utf-8").splitlines()]
+    return calls
+
+
+def make_pair(base_dir, file_id, words=("안녕", "하세요", "네")):
+    with open(os.path.join(base_dir, f"{file_id}.csv"), "w", encoding="utf-8") as f:
+        f.write("ID;ORT\n" + "".join(f"{i};{word}\n" for i, word in enumerate(words)))
+    with open(os.path.join(base_dir, f"{file_id}.wav"), "wb") as f:
+        f.write(file_id.encode("utf-8"))
+
+
+def run_main(base_dir, *args):
+    return subprocess.run(
+        [sys.executable, os.path.join(REPO_DIR, "MFA_pipeline.py"), str(base_dir), *args],
+        capture_output=True, text=True, encoding="utf-8",
+    )
+
+
+def test_sharded_alignment(tmp_path, stub_mfa):
+    for file_id in ["01", "02", "03", "04"]:
+        make_pair(tmp_path, file_id)
+        MFA_pipeline.csv_to_txt(tmp_path / f"{file_id}.csv", tmp_path / f"{file_id}.txt")
+    aligned_dir = tmp_path / "aligned"
+
+    failed = MFA_pipeline.run_mfa_sharded(str(tmp_path), ["04", "01", "03", "02"], "dict", "model", str(aligned_dir), shards=2)
+
+    assert failed == {}
+    assert sorted(call["speakers"] for call in stub_mfa()) == [["p01", "p03"], ["p02", "p04"]]
+    for file_id in ["01", "02", "03", "04"]:
+        assert (aligned_dir / f"p{file_id}" / f"{file_id}.TextGrid").exists()
+    # the originals stay where they are, the staging corpora and temporary directories are removed
+    assert (tmp_path / "01.wav").exists() and (tmp_path / "01.txt").exists()
+    assert not (tmp_path / "mfa_shards").exists() and not (tmp_path / "mfa_tmp").exists()
+
+
+def test_failing_shard(tmp_path, stub_mfa):
+    for file_id in ["01", "02", "3bad"]:
+        make_pair(tmp_path, file_id)
+        MFA_pipeline.csv_to_txt(tmp_path / f"{file_id}.csv", tmp_path / f"{file_id}.txt")
+    aligned_dir = tmp_path / "aligned"
+    done = []
+
+    failed = MFA_pipeline.run_mfa_sharded(
+        str(tmp_path), ["01", "02", "3bad"], "dict", "model", str(aligned_dir), shards=2, on_shard_done=done.extend,
+    )
+
+    # 01 and 3bad are in shard 0, 02 in shard 1
+    assert failed == {0: ["01", "3bad"]}
+    assert done == ["02"]
+    assert (aligned_dir / "p02" / "02.TextGrid").exists()
+    assert not (aligned_dir / "p01").exists()
+    # the staging corpus of the failed shard is kept for inspection
+    assert (tmp_path / "mfa_shards" / "shard_0" / "corpus" / "p3bad").exists()
+
+
+def test_pipeline_reruns_only_changed_pairs(tmp_path, stub_mfa):
+    for file_id in ["01", "02"]:
+        make_pair(tmp_path, file_id)
+
+    result = run_main(tmp_path, "--shards", "2")
+    assert result.returncode == 0, result.stdout
+    assert len(stub_mfa()) == 2
+    tg = textgrid.openTextgrid(str(tmp_path / "01_preprocessed.TextGrid"), includeEmptyIntervals=False)
+    assert tg.tierNames == ("turns", "utterances", "FPs")
+    assert [entry.label for entry in tg.getTier("utterances").entries] == ["안녕하세요", "네"]
+    manifest = json.loads((tmp_path / MFA_pipeline.MANIFEST_NAME).read_text(encoding="utf-8"))
+    assert sorted(manifest) == ["01", "02"]
+
+    # nothing changed: MFA is not called again
+    result = run_main(tmp_path)
+    assert result.returncode == 0
+    assert "0 new or changed file pairs to align, 2 up to date." in result.stdout
+    assert len(stub_mfa()) == 2
+
+    # only the changed pair is aligned
+    make_pair(tmp_path, "02", words=("네",))
+    result = run_main(tmp_path)
+    assert result.returncode == 0
+    assert stub_mfa()[-1]["speakers"] == ["p02"]
+
+
+def test_annotated_textgrid_is_not_overwritten(tmp_path, stub_mfa):
+    make_pair(tmp_path, "01")
+    assert run_main(tmp_path).returncode == 0
+
+    tg_path = tmp_path / "01_preprocessed.TextGrid"
+    tg = textgrid.openTextgrid(str(tg_path), includeEmptyIntervals=False)
+    tg.replaceTier("turns", textgrid.IntervalTier("turns", [(0.1, 0.8, "Q010"), (1.5, 1.9, "R010")], 0, tg.maxTimestamp))
+    tg.save(str(tg_path), format="short_textgrid", includeBlankSpaces=True)
+    annotated = tg_path.read_bytes()
+    make_pair(tmp_path, "01", words=("네",))
+
+    # the input changed, but the annotations win unless --force is given
+    result = run_main(tmp_path)
+    assert result.returncode == 1
+    assert "was annotated" in result.stdout
+    assert tg_path.read_bytes() == annotated
+    assert len(stub_mfa()) == 1
+
+    result = run_main(tmp_path, "--force")
+    assert result.returncode == 0
+    assert (tmp_path / "01_preprocessed.TextGrid.bak").read_bytes() == annotated
+    assert tg_path.read_bytes() != annotated
+
+
+def test_pairs_without_manifest_entry_are_recorded(tmp_path, stub_mfa):
+    for file_id in ["01", "02"]:
+        make_pair(tmp_path, file_id)
+    assert run_main(tmp_path).returncode == 0
+    (tmp_path / MFA_pipeline.MANIFEST_NAME).unlink()
+
+    for _ in range(2):
+        result = run_main(tmp_path)
+        assert result.returncode == 0, result.stdout
+        assert "0 new or changed file pairs to align, 2 up to date." in result.stdout
+    assert len(stub_mfa()) == 1
+
+
+def test_failed_pair_exits_nonzero(tmp_path, stub_mfa):
+    for file_id in ["01", "3bad"]:
+        make_pair(tmp_path, file_id)
+
+    result = run_main(tmp_path)
+    assert result.returncode == 1
+    assert "MFA alignment failed with exit code 3." in result.stdout
+    assert "MFA alignment complete." not in result.stdout
+    assert not (tmp_path / "01_preprocessed.TextGrid").exists()
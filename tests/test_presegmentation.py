@@ -0,0 +1,60 @@
+import wave
+import numpy as np
+import pytest
+from praatio import textgrid
+from presegmentation import presegment
+
+SAMPLE_RATE = 16000
+
+
+def write_wav(path, bursts, duration=6.0, sample_width=2):
+    # quiet noise with louder tone bursts at the given (start, end) times
+    rnd = np.random.default_rng(0)
+    t = np.arange(int(duration * SAMPLE_RATE)) / SAMPLE_RATE
+    x = 0.001 * rnd.standard_normal(len(t))
+    for start, end in bursts:
+        x[(t >= start) & (t < end)] += 0.5 * np.sin(2 * np.pi * 220 * t[(t >= start) & (t < end)])
+    full_scale = 2 ** (8 * sample_width - 1)
+    samples = np.clip(np.round(x * full_scale), -full_scale, full_scale - 1).astype(np.int32)
+    data = samples.astype("<i4").view(np.uint8).reshape(-1, 4)[:, :sample_width].tobytes()
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(sample_width)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(data)
+
+
+def write_textgrid(path, turns):
+    tg = textgrid.Textgrid()
+    tg.addTier(textgrid.IntervalTier("turns", turns, 0, 6))
+    tg.addTier(textgrid.IntervalTier("utterances", [(0.5, 1.5, "안녕하세요"), (2.5, 4.0, "네")], 0, 6))
+    tg.addTier(textgrid.PointTier("events", [(0.2, "start"), (5.5, "end")], 0, 6))
+    tg.save(str(path), format="short_textgrid", includeBlankSpaces=True)
+
+
+@pytest.mark.parametrize("sample_width", [2, 3])
+def test_fills_empty_tiers_and_keeps_point_tiers(tmp_path, sample_width):
+    wav_path, tg_path = tmp_path / "01.wav", tmp_path / "01_preprocessed.TextGrid"
+    write_wav(wav_path, [(0.5, 1.5), (2.5, 4.0), (4.4, 4.6)], sample_width=sample_width)
+    write_textgrid(tg_path, [])
+
+    assert presegment(str(tg_path), str(wav_path)) == (2, 1)
+    tg = textgrid.openTextgrid(str(tg_path), includeEmptyIntervals=False)
+    assert tg.tierNames == ("turns", "utterances", "events", "FPs")
+    assert [entry.label for entry in tg.getTier("turns").entries] == ["Q010", "R010"]
+    assert [entry.label for entry in tg.getTier("FPs").entries] == ["FP?"]
+    assert isinstance(tg.getTier("events"), textgrid.PointTier)
+    assert [tuple(entry) for entry in tg.getTier("events").entries] == [(0.2, "start"), (5.5, "end")]
+
+
+def test_annotated_file_is_left_as_it_is(tmp_path):
+    wav_path, tg_path = tmp_path / "01.wav", tmp_path / "01_preprocessed.TextGrid"
+    write_wav(wav_path, [(0.5, 1.5), (2.5, 4.0), (4.4, 4.6)])
+    write_textgrid(tg_path, [(0.5, 1.5, "Q010"), (2.5, 4.6, "R010")])
+    tg = textgrid.openTextgrid(str(tg_path), includeEmptyIntervals=True)
+    tg.addTier(textgrid.IntervalTier("FPs", [(4.4, 4.6, "음")], 0, 6))
+    tg.save(str(tg_path), format="long_textgrid", includeBlankSpaces=True)
+    annotated = tg_path.read_bytes()
+
+    presegment(str(tg_path), str(wav_path))
+    assert tg_path.read_bytes() == annotated
@@ -0,0 +1,56 @@
+import pytest
+from praatio import textgrid
+from textgrid_reader import read_textgrid
+
+LABELS = ["plain", 'say ""hi""', 'quote " inside', '"', "first line\nsecond line", "   ", "", "음", 'ends with "']
+
+
+def make_textgrid():
+    tg = textgrid.Textgrid()
+    intervals = [(i, i + 0.5, label) for i, label in enumerate(LABELS)]
+    tg.addTier(textgrid.IntervalTier("turns", intervals, 0, len(LABELS)))
+    tg.addTier(textgrid.PointTier("events", [(0.25, "start"), (1.75, 'a "b"'), (2.5, "x\ny")], 0, len(LABELS)))
+    tg.addTier(textgrid.IntervalTier("empty", [], 0, len(LABELS)))
+    tg.addTier(textgrid.IntervalTier("FPs", [(1.0, 1.2, "어"), (3.0, 3.1, "  음 ")], 0, len(LABELS)))
+    return tg
+
+
+def assert_same(tg, expected, tier_names=None):
+    assert (tg.minTimestamp, tg.maxTimestamp) == (expected.minTimestamp, expected.maxTimestamp)
+    names = [name for name in expected.tierNames if tier_names is None or name in tier_names]
+    assert list(tg.tierNames) == names
+    for name in names:
+        tier, expected_tier = tg.getTier(name), expected.getTier(name)
+        assert [tuple(entry) for entry in tier.entries] == [tuple(entry) for entry in expected_tier.entries]
+        assert (tier.minT, tier.maxT) == (expected_tier.minTimestamp, expected_tier.maxTimestamp)
+
+
+@pytest.mark.parametrize("file_format", ["short_textgrid", "long_textgrid"])
+@pytest.mark.parametrize("include_empty", [False, True])
+def test_same_as_praatio(tmp_path, monkeypatch, file_format, include_empty):
+    path = tmp_path / "01_preprocessed.TextGrid"
+    make_textgrid().save(str(path), format=file_format, includeBlankSpaces=True)
+    expected = textgrid.openTextgrid(str(path), includeEmptyIntervals=include_empty)
+    if file_format == "short_textgrid":
+        # the short format must be parsed by the reader itself, not by the praatio fallback
+        monkeypatch.setattr(textgrid, "openTextgrid", None)
+    assert_same(read_textgrid(str(path), include_empty=include_empty), expected)
+
+
+@pytest.mark.parametrize("file_format", ["short_textgrid", "long_textgrid"])
+def test_requested_tiers_only(tmp_path, file_format):
+    path = tmp_path / "01_preprocessed.TextGrid"
+    make_textgrid().save(str(path), format=file_format, includeBlankSpaces=True)
+    expected = textgrid.openTextgrid(str(path), includeEmptyIntervals=False)
+    for tier_names in (["turns"], ["FPs", "events"], ["empty", "missing"]):
+        assert_same(read_textgrid(str(path), tier_names), expected, tier_names)
+
+
+def test_stops_after_requested_tiers(tmp_path):
+    # everything after the last requested tier is never parsed, even if it is broken
+    path = tmp_path / "01_preprocessed.TextGrid"
+    make_textgrid().save(str(path), format="short_textgrid", includeBlankSpaces=True)
+    expected = textgrid.openTextgrid(str(path), includeEmptyIntervals=False)
+    text = path.read_text(encoding="utf-8")
+    path.write_text(text[:text.index('"FPs"')] + '"FPs"\nnot a number\n', encoding="utf-8")
+    assert_same(read_textgrid(str(path), ["turns"]), expected, ["turns"])
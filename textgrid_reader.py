@@ -0,0 +1,163 @@
+import os
+import sys
+import glob
+import time
+from collections import namedtuple
+from praatio import textgrid
+import instrumentation
+
+# Fast reader for the short TextGrid format this project writes (format="short_textgrid").
+# Only the requested tiers are parsed, entries are plain (start, end, label) / (time, label) tuples,
+# and reading stops as soon as all requested tiers have been found.
+# Other files (e.g. the long format written by MFA) fall back to praatio.
+
+INTERVAL_TIER = "IntervalTier"
+POINT_TIER = "TextTier"
+
+Tier = namedtuple("Tier", ["name", "entries", "minT", "maxT", "tierType"])
+
+
+# Lightweight stand-in for praatio's Textgrid with the parts of its API used in this project
+class LightTextgrid:
+    def __init__(self, minTimestamp, maxTimestamp, tiers=()):
+        self.minTimestamp = minTimestamp
+        self.maxTimestamp = maxTimestamp
+        self._tiers = {tier.name: tier for tier in tiers}
+
+    @property
+    def tierNames(self):
+        return tuple(self._tiers)
+
+    def getTier(self, tierName):
+        return self._tiers[tierName]
+
+    def addTier(self, tier):
+        # accepts a Tier or a praatio tier
+        if not isinstance(tier, Tier):
+            tier_type = POINT_TIER if isinstance(tier, textgrid.PointTier) else INTERVAL_TIER
+            tier = Tier(tier.name, [tuple(entry) for entry in tier.entries], tier.minTimestamp, tier.maxTimestamp, tier_type)
+        if tier.name in self._tiers:
+            raise ValueError(f"Tier name '{tier.name}' already exists in TextGrid")
+        self._tiers[tier.name] = tier
+
+    def removeTier(self, name):
+        return self._tiers.pop(name)
+
+    def to_praatio(self):
+        tg = textgrid.Textgrid(self.minTimestamp, self.maxTimestamp)
+        for tier in self._tiers.values():
+            tier_class = textgrid.PointTier if tier.tierType == POINT_TIER else textgrid.IntervalTier
+            tg.addTier(tier_class(tier.name, tier.entries, tier.minT, tier.maxT))
+        return tg
+
+    def save(self, fn, format, includeBlankSpaces):
+        self.to_praatio().save(fn, format=format, includeBlankSpaces=includeBlankSpaces)
+
+
+def _read_text(first_line, lines):
+    # a quoted text ends with an odd run of quote marks ("" is an escaped quote) and may span several lines
+    text = first_line.strip()
+    while not _is_closed(text):
+        text += "\n" + next(lines).rstrip("\n")
+    return text.strip()[1:-1].strip().replace('""', '"')
+
+
+def _is_closed(text):
+    if len(text) < 2 or text[0] != '"':
+        return len(text) >= 2
+    # count the quote marks at the end, ignoring the opening one
+    body = text[1:]
+    trailing = len(body) - len(body.rstrip('"'))
+    return trailing % 2 == 1
+
+
+def _read_short(lines, tier_names, include_empty):
+    header = [next(lines).strip() for _ in range(7)]
+    if "ooTextFile" not in header[0] or header[5] != "<exists>":
+        return None
+    try:
+        min_t, max_t = float(header[3]), float(header[4])
+    except ValueError:
+        return None  # not the short format
+    tier_count = int(header[6])
+
+    wanted = None if tier_names is None else set(tier_names)
+    tiers = []
+    for _ in range(tier_count):
+        if wanted is not None and not wanted:
+            break  # all requested tiers found, the rest of the file is never read
+        tier_type = _read_text(next(lines), lines)
+        name = _read_text(next(lines), lines)
+        tier_min = float(next(lines))
+        tier_max = float(next(lines))
+        count = int(next(lines))
+        keep = wanted is None or name in wanted
+        rows = 3 if tier_type == INTERVAL_TIER else 2
+
+        entries = []
+        for _ in range(count):
+            values = [next(lines) for _ in range(rows - 1)]
+            label = _read_text(next(lines), lines)
+            if not keep or (not include_empty and label == ""):
+                continue
+            entries.append((*(float(value) for value in values), label))
+
+        if keep:
+            tiers.append(Tier(name, entries, tier_min, tier_max, tier_type))
+            if wanted is not None:
+                wanted.discard(name)
+
+    return LightTextgrid(min_t, max_t, tiers)
+
+
+def _open(path):
+    # praat writes utf-16 (with BOM) when labels are not ascii, this project writes utf-8
+    with open(path, "rb") as f:
+        bom = f.read(2)
+    encoding = "utf-16" if bom in (b"\xff\xfe", b"\xfe\xff") else "utf-8-sig"
+    return open(path, "r", encoding=encoding)
+
+
+def read_textgrid(path, tier_names=None, include_empty=False):
+    # tier_names=None reads all tiers; missing requested tiers are simply absent from the result
+    with instrumentation.stage("read_textgrid", file=path) as s:
+        with _open(path) as f:
+            try:
+                tg = _read_short(iter(f), tier_names, include_empty)
+            except (StopIteration, ValueError):
+                tg = None
+
+        if tg is None:
+            # fallback: long format (or anything else praatio understands)
+            full_tg = textgrid.openTextgrid(path, includeEmptyIntervals=include_empty)
+            tg = LightTextgrid(full_tg.minTimestamp, full_tg.maxTimestamp)
+            for name in full_tg.tierNames:
+                if tier_names is None or name in tier_names:
+                    tg.addTier(full_tg.getTier(name))
+
+        s.items = sum(len(tg.getTier(name).entries) for name in tg.tierNames)
+    return tg
+
+
+# Benchmark: python textgrid_reader.py <TextGridFolder> [tier ...]
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python textgrid_reader.py <TextGridFolder> [tier ...]")
+        sys.exit(1)
+
+    paths = sorted(glob.glob(os.path.join(sys.argv[1], "*.TextGrid")))
+    tiers = sys.argv[2:] or None
+
+    start = time.perf_counter()
+    for path in paths:
+        textgrid.openTextgrid(path, includeEmptyIntervals=False)
+    praatio_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for path in paths:
+        read_textgrid(path, tiers)
+    reader_time = time.perf_counter() - start
+
+    print(f"{len(paths)} files, tiers: {', '.join(tiers) if tiers else 'all'}")
+    print(f"praatio: {praatio_time:.3f} s")
+    print(f"reader:  {reader_time:.3f} s ({praatio_time / reader_time:.1f}x faster)")